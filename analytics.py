@@ -0,0 +1,110 @@
+#(©)Codexbotz
+
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from config import ANALYTICS_FLUSH_INTERVAL, LOGGER
+from pymongo.errors import BulkWriteError
+
+from database.database import save_link_hours, save_link_opens, save_user_activity
+from metrics import Gauge
+
+
+# Link opens and user activity are counted in memory and written every
+# ANALYTICS_FLUSH_INTERVAL seconds, a thousand opens of one link cost a single
+# update. Counts not yet written are lost if the process is killed, Bot.stop and
+# Worker.stop flush them.
+class Analytics:
+    def __init__(self):
+        self.reset()
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def reset(self):
+        # link -> [opens, last opened]
+        self.links = {}
+        # (link, hour) -> opens
+        self.hours = Counter()
+        # user id -> [Counter of opens / delivered, last seen]
+        self.users = {}
+
+    def pending(self) -> int:
+        return len(self.links) + len(self.hours) + len(self.users)
+
+    def _user(self, user_id: int, now: datetime, **counts):
+        entry = self.users.get(user_id)
+        if entry is None:
+            entry = self.users[user_id] = [Counter(), now]
+        entry[0].update(counts)
+        entry[1] = max(entry[1], now)
+
+    def seen(self, user_id: int):
+        self._user(user_id, datetime.utcnow())
+
+    def opened(self, user_id: int, link: str):
+        now = datetime.utcnow()
+        entry = self.links.setdefault(link, [0, now])
+        entry[0] += 1
+        entry[1] = max(entry[1], now)
+        self.hours[(link, now.replace(minute=0, second=0, microsecond=0))] += 1
+        self._user(user_id, now, opens=1)
+
+    def delivered(self, user_id: int, count: int):
+        self._user(user_id, datetime.utcnow(), delivered=count)
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending():
+                return
+            links, hours, users = self.links, self.hours, self.users
+            self.reset()
+            # each collection is written on its own, only what did not commit goes back
+            if links and not await self.save(save_link_opens, {link: tuple(entry) for link, entry in links.items()}, "link opens"):
+                self.merge(links, {}, {})
+            if hours and not await self.save(save_link_hours, dict(hours), "link hours"):
+                self.merge({}, hours, {})
+            if users and not await self.save(save_user_activity, {user_id: (dict(counts), last) for user_id, (counts, last) in users.items()}, "user activity"):
+                self.merge({}, {}, users)
+
+    async def save(self, write, data: dict, name: str) -> bool:
+        # False when nothing was written. A BulkWriteError means some updates were
+        # applied and $inc can't tell which, writing them again would count twice
+        try:
+            await write(data)
+        except BulkWriteError as e:
+            LOGGER(__name__).warning(f"Writing {name} partly failed, {len(e.details.get('writeErrors', []))} of {len(data)} updates lost")
+        except Exception as e:
+            LOGGER(__name__).warning(f"Writing {name} failed, kept for the next flush: {e}")
+            return False
+        return True
+
+    def merge(self, links, hours, users):
+        # what failed to write goes back in with what came in meanwhile
+        for link, (opens, last) in links.items():
+            entry = self.links.setdefault(link, [0, last])
+            entry[0] += opens
+            entry[1] = max(entry[1], last)
+        self.hours.update(hours)
+        for user_id, (counts, last) in users.items():
+            self._user(user_id, last, **counts)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(ANALYTICS_FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+
+analytics = Analytics()
+
+Gauge("filebot_analytics_pending", "Links, link hours and users with counts not yet written", lambda: analytics.pending())
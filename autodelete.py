@@ -0,0 +1,158 @@
+#(©)Codexbotz
+
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timedelta
+
+from pyrogram.errors import BadRequest, Forbidden
+
+from config import AUTO_DELETE_TIME, LOGGER
+from database.database import add_deletions, due_deletions, postpone_deletions, remove_deletions
+from metrics import Gauge
+from pool import pool
+from scheduler import BROADCAST, scheduler
+
+# deletions due within LOOKAHEAD seconds are held in memory, Mongo is asked every POLL_INTERVAL
+LOOKAHEAD = 60
+POLL_INTERVAL = 30
+LOAD_LIMIT = 5000
+
+# most message ids Telegram takes in one delete call
+DELETE_CHUNK_SIZE = 100
+
+# seconds before deletions that failed are tried again
+RETRY_DELAY = 300
+
+
+# Delivered copies are scheduled for deletion as documents of the deletions
+# collection, one per chat and sending bot with the time they are due. Only the bot
+# process deletes: it loads what is due soon into a min-heap and sleeps until the
+# earliest entry, so pending deletions cost a document each instead of a sleeping
+# task. After a restart the overdue documents are simply due and the first load
+# catches up on them.
+class AutoDelete:
+    def __init__(self):
+        self.heap = []
+        # ids of the documents in the heap
+        self.loaded = set()
+        self.order = itertools.count()
+        self.client = None
+        self.task = None
+        self.wakeup = None
+
+    async def schedule(self, chat_id: int, messages: list):
+        if not AUTO_DELETE_TIME or not messages:
+            return
+        due = datetime.utcnow() + timedelta(seconds = AUTO_DELETE_TIME)
+        # a bot can only delete what it sent itself, helper messages are kept apart
+        senders = {}
+        for message in messages:
+            senders.setdefault(pool.owner(message._client), []).append(message.id)
+        docs = [{'chat_id': chat_id, 'sender': sender, 'msg_ids': ids, 'due': due} for sender, ids in senders.items()]
+        ids = await add_deletions(docs)
+        if self.task and AUTO_DELETE_TIME <= LOOKAHEAD:
+            # sooner than the next poll would find them
+            for doc_id, doc in zip(ids, docs):
+                self.push(dict(doc, _id = doc_id))
+            self.wakeup.set()
+
+    def push(self, doc: dict):
+        if doc['_id'] in self.loaded:
+            return
+        self.loaded.add(doc['_id'])
+        heapq.heappush(self.heap, (doc['due'], next(self.order), doc))
+
+    async def load(self) -> bool:
+        # True when more is overdue than one load takes, catching up after a restart
+        now = datetime.utcnow()
+        docs = await due_deletions(now + timedelta(seconds = LOOKAHEAD), LOAD_LIMIT)
+        for doc in docs:
+            self.push(doc)
+        return len(docs) == LOAD_LIMIT and docs[-1]['due'] <= now
+
+    async def delete_due(self):
+        now = datetime.utcnow()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[2])
+        if not due:
+            return
+        # everything due together goes out as one call per chat and sender
+        chats = {}
+        for doc in due:
+            chats.setdefault((doc['sender'], doc['chat_id']), []).extend(doc['msg_ids'])
+        batches = list(chats)
+        results = await asyncio.gather(*(self.delete(sender, chat_id, chats[(sender, chat_id)]) for sender, chat_id in batches))
+        failed = {batch for batch, ok in zip(batches, results) if not ok}
+        done = [doc['_id'] for doc in due if (doc['sender'], doc['chat_id']) not in failed]
+        retry = [doc['_id'] for doc in due if (doc['sender'], doc['chat_id']) in failed]
+        try:
+            await remove_deletions(done)
+            # pushed back in Mongo, a later load picks them up again
+            await postpone_deletions(retry, now + timedelta(seconds = RETRY_DELAY))
+        except Exception as e:
+            # deleting them again next time is harmless
+            LOGGER(__name__).warning(f"Updating {len(due)} handled deletions failed: {e}")
+        self.loaded.difference_update(doc['_id'] for doc in due)
+
+    async def delete(self, sender, chat_id: int, ids: list) -> bool:
+        # False when the messages should be tried again later
+        client = self.client if sender is None else pool.client(sender)
+        if client is None:
+            LOGGER(__name__).warning(f"{len(ids)} messages in {chat_id} not deleted yet, {sender} is not running", extra={"throttle": "auto_delete"})
+            return False
+        ok = True
+        for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+            chunk = ids[start:start + DELETE_CHUNK_SIZE]
+            try:
+                # housekeeping, it only gets what deliveries leave
+                await scheduler.submit(BROADCAST, "auto_delete", lambda: client.delete_messages(chat_id, chunk))
+            except (BadRequest, Forbidden) as e:
+                # the chat is gone or the bot was blocked, trying again won't help
+                LOGGER(__name__).warning(f"Deleting {len(chunk)} messages in {chat_id} failed for good: {e}", extra={"throttle": "auto_delete"})
+            except Exception as e:
+                LOGGER(__name__).warning(f"Deleting {len(chunk)} messages in {chat_id} failed, retried later: {e}", extra={"throttle": "auto_delete"})
+                ok = False
+        return ok
+
+    def next_wait(self, next_poll: float) -> float:
+        wait = next_poll - asyncio.get_running_loop().time()
+        if self.heap:
+            wait = min(wait, (self.heap[0][0] - datetime.utcnow()).total_seconds())
+        return max(0, wait)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_poll = 0
+        while True:
+            try:
+                if loop.time() >= next_poll:
+                    more = await self.load()
+                    next_poll = loop.time() + (0 if more else POLL_INTERVAL)
+                await self.delete_due()
+            except Exception as e:
+                LOGGER(__name__).warning(f"Auto delete failed: {e}")
+                next_poll = loop.time() + POLL_INTERVAL
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.next_wait(next_poll))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, client):
+        if AUTO_DELETE_TIME and self.task is None:
+            self.client = client
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        # nothing to save, the documents stay in Mongo until deleted
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+
+auto_delete = AutoDelete()
+
+Gauge("filebot_auto_delete_loaded", "Scheduled deletions due soon and held in memory", lambda: len(auto_delete.heap))
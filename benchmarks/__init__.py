@@ -0,0 +1 @@
+#(©)Codexbotz
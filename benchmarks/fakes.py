@@ -0,0 +1,188 @@
+#(©)Codexbotz
+
+import asyncio
+import itertools
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+from pyrogram import Client
+from pyrogram.enums import ChatMemberStatus, ChatType, MessageMediaType
+from pyrogram.errors import FloodWait, UserNotParticipant
+from pyrogram.raw import functions, types
+
+from governor import GovernedClient
+
+# Offline stand-ins for the Telegram side of the bot. FakeClient is a real
+# GovernedClient whose transport is replaced: every high level method the bot uses
+# builds the raw query it would send and passes it through the same invoke, so the
+# governor, metrics and profiler all see the call; the "network" is a sleep of
+# `latency` seconds that raises FloodWait with probability `flood_rate`.
+
+
+class Text(str):
+    @property
+    def html(self):
+        return str(self)
+
+
+def peer(chat_id):
+    if chat_id < 0:
+        return types.InputPeerChannel(channel_id=abs(chat_id), access_hash=0)
+    return types.InputPeerUser(user_id=chat_id, access_hash=0)
+
+
+def channel(chat_id):
+    return types.InputChannel(channel_id=abs(chat_id), access_hash=0)
+
+
+class FakeMessage:
+    def __init__(self, client, chat_id, msg_id, text=None, document=None, caption=None, media_group_id=None, from_user=None, reply_to_message=None):
+        self._client = client
+        self.id = msg_id
+        self.chat = SimpleNamespace(id=chat_id, type=ChatType.PRIVATE if chat_id > 0 else ChatType.CHANNEL)
+        self.from_user = from_user
+        self.outgoing = False
+        self.empty = False
+        self.service = None
+        self.text = Text(text) if text is not None else None
+        self.command = text.split() if text and text.startswith("/") else None
+        if self.command:
+            self.command[0] = self.command[0][1:]
+        self.document = document
+        self.media = MessageMediaType.DOCUMENT if document else None
+        self.caption = Text(caption) if caption else None
+        self.media_group_id = media_group_id
+        self.reply_markup = None
+        self.reply_to_message = reply_to_message
+        self.forward_from_chat = None
+        self.forward_sender_name = None
+
+    @classmethod
+    def empty_message(cls, client, chat_id, msg_id):
+        message = cls(client, chat_id, msg_id)
+        message.empty = True
+        return message
+
+    async def copy(self, chat_id, caption=None, reply_markup=None, **kwargs):
+        if self.document:
+            return await self._client.send_cached_media(chat_id, self.document.file_id, caption=self.caption if caption is None else caption)
+        return await self._client.send_message(chat_id, self.text)
+
+    async def delete(self):
+        return await self._client.delete_messages(self.chat.id, [self.id])
+
+    async def reply(self, text, quote=None, **kwargs):
+        return await self._client.send_message(self.chat.id, text)
+
+    reply_text = reply
+
+    async def edit(self, text, **kwargs):
+        return await self._client.edit_message_text(self.chat.id, self.id, text)
+
+    edit_text = edit
+
+    async def edit_reply_markup(self, reply_markup=None):
+        await self._client.invoke(functions.messages.EditMessage(peer=peer(self.chat.id), id=self.id))
+        self.reply_markup = reply_markup
+        return self
+
+
+class FakeTransport(Client):
+    # takes the place of the session, GovernedClient.invoke ends up here
+    async def invoke(self, query, retries=0, timeout=0, sleep_threshold=None):
+        self.calls[type(query).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.floods += 1
+            raise FloodWait(value=self.flood_seconds)
+        return None
+
+
+class FakeClient(GovernedClient, FakeTransport):
+    def __init__(self, latency: float = 0.05, flood_rate: float = 0.0, flood_seconds: int = 1, channel_id: int = -1001234567890, members=None, **kwargs):
+        # no updates unless a dispatcher is wanted, see benchmarks/loadgen.py
+        kwargs.setdefault("no_updates", True)
+        super().__init__(name="Bench", api_id=1, api_hash="0" * 32, in_memory=True, **kwargs)
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.calls = Counter()
+        self.floods = 0
+        self.username = "bench_bot"
+        self.me = SimpleNamespace(id=1, username=self.username)
+        self.invitelink = "https://t.me/+bench"
+        self.db_channel = SimpleNamespace(id=channel_id, username=None)
+        self.db_channels = [self.db_channel]
+        # force sub members, None lets everybody in
+        self.members = members
+        # every message by (chat id, message id), DB channel posts included
+        self.messages = {}
+        self.counters = {}
+        # messages each chat received
+        self.received = Counter()
+
+    def _store(self, chat_id, sent=True, **kwargs):
+        counter = self.counters.setdefault(chat_id, itertools.count(1))
+        message = FakeMessage(self, chat_id, next(counter), **kwargs)
+        self.messages[(chat_id, message.id)] = message
+        if sent:
+            self.received[chat_id] += 1
+        return message
+
+    def seed_posts(self, count: int, album_size: int = 0):
+        # DB channel posts without going through the API, documents in albums of album_size
+        posts = []
+        for number in range(count):
+            group = f"album{number // album_size}" if album_size else None
+            document = SimpleNamespace(file_id=f"file{number}", file_name=f"file{number}.mkv", file_size=1024 * number)
+            posts.append(self._store(self.db_channel.id, sent=False, document=document, caption=f"post {number}", media_group_id=group))
+        return posts
+
+    def user_message(self, user_id: int, text: str = None, document=None, reply_to_message=None):
+        # an incoming private message, as a handler would get it
+        user = SimpleNamespace(id=user_id, first_name="User", last_name=None, username=None, mention=f"user{user_id}")
+        return self._store(user_id, sent=False, text=text, document=document, from_user=user, reply_to_message=reply_to_message)
+
+    async def get_messages(self, chat_id, message_ids):
+        ids = [message_ids] if isinstance(message_ids, int) else list(message_ids)
+        await self.invoke(functions.channels.GetMessages(channel=channel(chat_id), id=[types.InputMessageID(id=i) for i in ids]))
+        found = [self.messages.get((chat_id, i)) or FakeMessage.empty_message(self, chat_id, i) for i in ids]
+        return found[0] if isinstance(message_ids, int) else found
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self.invoke(functions.messages.SendMessage(peer=peer(chat_id), message=str(text), random_id=0))
+        return self._store(chat_id, text=text)
+
+    async def send_cached_media(self, chat_id, file_id, caption=None, **kwargs):
+        await self.invoke(functions.messages.SendMedia(peer=peer(chat_id), media=types.InputMediaEmpty(), message="", random_id=0))
+        document = SimpleNamespace(file_id=file_id, file_name=None, file_size=0)
+        return self._store(chat_id, document=document, caption=caption)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self.invoke(functions.messages.SendMultiMedia(peer=peer(chat_id), multi_media=[]))
+        group = f"sent{random.getrandbits(32)}"
+        return [
+            self._store(chat_id, document=SimpleNamespace(file_id=item.media, file_name=None, file_size=0), caption=item.caption, media_group_id=group)
+            for item in media
+        ]
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        await self.invoke(functions.messages.EditMessage(peer=peer(chat_id), id=message_id, message=str(text)))
+        message = self.messages.get((chat_id, message_id))
+        if message:
+            message.text = Text(text)
+        return message
+
+    async def delete_messages(self, chat_id, message_ids):
+        await self.invoke(functions.messages.DeleteMessages(id=list(message_ids)))
+        for message_id in message_ids:
+            self.messages.pop((chat_id, message_id), None)
+        return True
+
+    async def get_chat_member(self, chat_id, user_id):
+        await self.invoke(functions.channels.GetParticipant(channel=channel(chat_id), participant=peer(user_id)))
+        if self.members is not None and user_id not in self.members:
+            raise UserNotParticipant()
+        return SimpleNamespace(status=ChatMemberStatus.MEMBER)
@@ -0,0 +1,247 @@
+#(©)Codexbotz
+
+# Synthetic deep-link traffic through the real dispatcher, to size TG_BOT_WORKERS
+# and the number of dynos before a campaign:
+#
+#   python3 benchmarks/loadgen.py --workers 4 --users 300 --duration 60
+#
+# Simulated users open links picked from a Zipf popularity mix, wait for the
+# files, think for a while and open the next one. Updates go through pyrogram's
+# own Dispatcher with the plugins loaded, so filters, handler order and the
+# force sub check all run as in production; only Telegram (benchmarks.fakes) and
+# Mongo (benchmarks.memdb) are stand-ins.
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.run import FIRST_USER_ID, configure, percentile
+
+QUEUE_SAMPLE_INTERVAL = 0.1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay deep-link traffic against the bot's dispatcher")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("TG_BOT_WORKERS", "4")), help="TG_BOT_WORKERS to test")
+    parser.add_argument("--users", type=int, default=200, help="users active at the same time")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--think", type=float, default=2.0, help="mean seconds a user waits between links")
+    parser.add_argument("--links", type=int, default=500, help="distinct links in circulation")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of link popularity")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 1, 1, 1, 5, 10, 25, 50], help="sizes a link is drawn from")
+    parser.add_argument("--members", type=float, default=0.8, help="share of users in the force sub channel")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds every fake Telegram call takes")
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the configured API rates instead of lifting them")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="load_results.json")
+    return parser.parse_args()
+
+
+class Request:
+    def __init__(self, link_size: int):
+        self.size = link_size
+        self.enqueued = time.perf_counter()
+        self.dequeued = None
+        self.handled = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    def finish(self, *args):
+        if not self.done.done():
+            self.done.set_result(time.perf_counter())
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.requests = []
+        self.queue_depths = []
+        # dispatcher worker seconds, from taking an update off the queue to the handler returning
+        self.busy = 0.0
+        # deliveries started by the handler now running, by chat
+        self.deliveries = {}
+
+    async def setup(self):
+        from benchmarks import memdb
+        from benchmarks.fakes import FakeClient, FakeMessage
+        from helper_func import encode_link
+        from metrics import plugin_callback, uninstrumented
+        import plugins.start as start_plugin
+        from delivery import start_delivery
+        from pyrogram.handlers import MessageHandler
+
+        memdb.install()
+        users = range(FIRST_USER_ID, FIRST_USER_ID + self.args.users)
+        members = {user_id for user_id in users if random.random() < self.args.members}
+        self.client = FakeClient(
+            latency = self.args.latency,
+            flood_rate = self.args.flood_rate,
+            flood_seconds = self.args.flood_seconds,
+            members = members,
+            no_updates = False,
+            workers = self.args.workers,
+            plugins = {"root": "plugins"}
+        )
+        posts = self.client.seed_posts(5000)
+
+        # links with a Zipf popularity, link k is picked with weight 1 / k ** s
+        self.links = []
+        for _ in range(self.args.links):
+            size = random.choice(self.args.batch_sizes)
+            first = random.randint(1, len(posts) - size + 1)
+            self.links.append((encode_link([(first, first + size - 1)]), size))
+        self.weights = [1 / rank ** self.args.zipf for rank in range(1, len(self.links) + 1)]
+
+        def tracked(client, chat_id, *args):
+            self.deliveries[chat_id] = start_delivery(client, chat_id, *args)
+            return self.deliveries[chat_id]
+
+        start_plugin.start_delivery = tracked
+
+        self.client.load_plugins()
+        # handlers are added by tasks, let them run
+        for _ in range(3):
+            await asyncio.sleep(0)
+        # handlers are wrapped as they are registered, as in the bot, none may be missed
+        missing = uninstrumented(self.client)
+        if missing:
+            raise RuntimeError(f"Handlers not instrumented: {', '.join(missing)}")
+        for group in self.client.dispatcher.groups.values():
+            for handler in group:
+                attr = plugin_callback(handler)
+                setattr(handler, attr, self.track(getattr(handler, attr)))
+
+        async def parser(update, users, chats):
+            # a pre-built message stands in for the raw update, the parser hands it straight on
+            update.request.dequeued = time.perf_counter()
+            return update, MessageHandler
+
+        self.client.dispatcher.update_parsers[FakeMessage] = parser
+        await self.client.dispatcher.start()
+
+    def track(self, callback):
+        @functools.wraps(callback)
+        async def wrapper(client, update, *args):
+            request = getattr(update, "request", None)
+            try:
+                return await callback(client, update, *args)
+            finally:
+                if request:
+                    request.handled = time.perf_counter()
+                    self.busy += request.handled - request.dequeued
+                    task = self.deliveries.pop(update.chat.id, None)
+                    if task:
+                        task.add_done_callback(request.finish)
+                    else:
+                        request.finish()
+        return wrapper
+
+    async def think(self, seconds: float, deadline: float):
+        # never past the deadline, the run would wait for the longest think
+        await asyncio.sleep(max(0, min(seconds, deadline - time.perf_counter())))
+
+    async def user(self, user_id: int, deadline: float):
+        await self.think(random.uniform(0, self.args.think), deadline)
+        while time.perf_counter() < deadline:
+            link, size = random.choices(self.links, self.weights)[0]
+            message = self.client.user_message(user_id, f"/start {link}")
+            message.request = Request(size)
+            self.requests.append(message.request)
+            self.client.dispatcher.updates_queue.put_nowait((message, {}, {}))
+            await message.request.done
+            await self.think(random.expovariate(1 / self.args.think) if self.args.think else 0, deadline)
+
+    async def sample_queue(self):
+        while True:
+            self.queue_depths.append(self.client.dispatcher.updates_queue.qsize())
+            await asyncio.sleep(QUEUE_SAMPLE_INTERVAL)
+
+    async def run(self):
+        await self.setup()
+        sampler = asyncio.create_task(self.sample_queue())
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        await asyncio.gather(*(self.user(user_id, deadline) for user_id in range(FIRST_USER_ID, FIRST_USER_ID + self.args.users)))
+        wall = time.perf_counter() - start
+        sampler.cancel()
+        await self.client.dispatcher.stop()
+        return self.report(wall)
+
+    def report(self, wall):
+        # rates are over the traffic window, requests still running at the deadline
+        # finish after it and only stretch the wall time
+        window = self.args.duration
+        import profiler
+        from metrics import delivered_items
+
+        done = [request for request in self.requests if request.done.done()]
+        latency = [request.done.result() - request.enqueued for request in done]
+        waits = [request.dequeued - request.enqueued for request in done if request.dequeued]
+        handlers = {
+            name: {
+                "calls": len(entries),
+                "p50_ms": round(percentile([entry[0] for entry in entries], 50) * 1000, 2),
+                "p99_ms": round(percentile([entry[0] for entry in entries], 99) * 1000, 2)
+            }
+            for name, entries in profiler.samples.items()
+        }
+
+        def ms(values):
+            return {f"p{point}": round(percentile(values, point) * 1000, 2) for point in (50, 95, 99)}
+
+        return {
+            "workers": self.args.workers,
+            "wall_seconds": round(wall, 2),
+            "requests": len(done),
+            "requests_per_second": round(len(done) / window, 2),
+            "files_per_second": round(delivered_items.values.get((), 0) / window, 2),
+            "latency_ms": ms(latency),
+            "queue_wait_ms": ms(waits),
+            "worker_utilization": round(self.busy / (self.args.workers * window), 3),
+            "queue_depth": {
+                "max": max(self.queue_depths, default=0),
+                "mean": round(sum(self.queue_depths) / len(self.queue_depths), 2) if self.queue_depths else 0
+            },
+            "handlers": handlers,
+            "api_calls": dict(self.client.calls),
+            "flood_waits": self.client.floods
+        }
+
+
+async def main(args):
+    random.seed(args.seed)
+    return await LoadTest(args).run()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure(args)
+    os.environ["TG_BOT_WORKERS"] = str(args.workers)
+    # plugins are found relative to the working directory
+    args.output = os.path.abspath(args.output)
+    os.chdir(ROOT)
+    report = asyncio.run(main(args))
+    print(
+        f"workers {report['workers']}: {report['requests_per_second']} req/s, {report['files_per_second']} files/s, "
+        f"latency p50/p99 {report['latency_ms']['p50']}/{report['latency_ms']['p99']} ms, "
+        f"queue wait p99 {report['queue_wait_ms']['p99']} ms, utilization {report['worker_utilization']:.0%}"
+    )
+    with open(args.output, "w") as file:
+        json.dump({
+            "generated": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "args": vars(args),
+            "report": report
+        }, file, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,282 @@
+#(©)Codexbotz
+
+import asyncio
+import copy
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+# In-process stand-in for the motor collections in database/database.py. It covers
+# the queries and updates that module issues, nothing more, and keeps documents in
+# a dict by _id. Every call yields to the event loop once, like a real round trip.
+
+
+def get_field(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+
+def compare(value, op, arg):
+    if op == "$in":
+        return value in arg
+    if op == "$nin":
+        return value not in arg
+    if op == "$ne":
+        return value != arg
+    if op == "$exists":
+        return (value is not None) == arg
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > arg
+    if op == "$gte":
+        return value >= arg
+    if op == "$lt":
+        return value < arg
+    if op == "$lte":
+        return value <= arg
+    raise NotImplementedError(op)
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = get_field(doc, key)
+        if isinstance(cond, dict) and cond and all(op.startswith("$") for op in cond):
+            if not all(compare(value, op, arg) for op, arg in cond.items()):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {key for key, on in projection.items() if on and key != "_id"}
+    if include:
+        out = {key: copy.deepcopy(doc[key]) for key in include if key in doc}
+    else:
+        out = {key: copy.deepcopy(value) for key, value in doc.items() if projection.get(key, 1)}
+    if projection.get("_id", 1) and "_id" in doc:
+        out["_id"] = doc["_id"]
+    return out
+
+
+def apply_update(doc, update, inserting):
+    for op, fields in update.items():
+        for key, value in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                doc[key] = copy.deepcopy(value)
+            elif op == "$inc":
+                doc[key] = doc.get(key, 0) + value
+            elif op == "$max":
+                doc[key] = value if doc.get(key) is None else max(doc[key], value)
+            elif op == "$min":
+                doc[key] = value if doc.get(key) is None else min(doc[key], value)
+            elif op == "$unset":
+                doc.pop(key, None)
+            elif op == "$push":
+                doc.setdefault(key, []).append(value)
+            elif op != "$setOnInsert":
+                raise NotImplementedError(op)
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, way in reversed(keys):
+            self.docs.sort(key=lambda doc: (get_field(doc, field) is not None, get_field(doc, field)), reverse=way < 0)
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def skip(self, n):
+        self.docs = self.docs[n:]
+        return self
+
+    def _result(self):
+        return self.docs[:self._limit] if self._limit else self.docs
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(0)
+        docs = self._result()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await asyncio.sleep(0)
+        for doc in self._result():
+            yield doc
+
+
+class Collection:
+    def __init__(self, name):
+        self.name = name
+        self.docs = {}
+
+    def _select(self, query):
+        query = query or {}
+        key = query.get("_id")
+        if key is not None and not isinstance(key, dict):
+            # the common lookup by _id skips the scan
+            doc = self.docs.get(key)
+            return [doc] if doc is not None and matches(doc, query) else []
+        return [doc for doc in self.docs.values() if matches(doc, query)]
+
+    def _upsert_doc(self, query):
+        doc = {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+        doc.setdefault("_id", ObjectId())
+        return doc
+
+    async def create_index(self, *args, **kwargs):
+        return "index"
+
+    async def estimated_document_count(self):
+        await asyncio.sleep(0)
+        return len(self.docs)
+
+    async def count_documents(self, query):
+        await asyncio.sleep(0)
+        return len(self._select(query))
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        await asyncio.sleep(0)
+        docs = self._select(query)
+        if sort:
+            docs = Cursor(docs).sort(sort).docs
+        return project(docs[0], projection) if docs else None
+
+    def find(self, query=None, projection=None):
+        return Cursor([project(doc, projection) for doc in self._select(query)])
+
+    async def insert_one(self, doc):
+        await asyncio.sleep(0)
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise KeyError(f"duplicate _id {doc['_id']}")
+        self.docs[doc["_id"]] = doc
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def replace_one(self, query, doc, upsert=False):
+        await asyncio.sleep(0)
+        docs = self._select(query)[:1]
+        if docs:
+            del self.docs[docs[0]["_id"]]
+        elif not upsert:
+            return SimpleNamespace(matched_count=0, upserted_id=None)
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", docs[0]["_id"] if docs else self._upsert_doc(query)["_id"])
+        self.docs[doc["_id"]] = doc
+        return SimpleNamespace(matched_count=len(docs), upserted_id=None if docs else doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        ids = [(await self.insert_one(doc)).inserted_id for doc in docs]
+        return SimpleNamespace(inserted_ids=ids)
+
+    def _update(self, query, update, upsert, many):
+        docs = self._select(query)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            apply_update(doc, update, False)
+        upserted_id = None
+        if not docs and upsert:
+            doc = self._upsert_doc(query)
+            apply_update(doc, update, True)
+            self.docs[doc["_id"]] = doc
+            upserted_id = doc["_id"]
+        return SimpleNamespace(matched_count=len(docs), modified_count=len(docs), upserted_id=upserted_id)
+
+    async def update_one(self, query, update, upsert=False):
+        await asyncio.sleep(0)
+        return self._update(query, update, upsert, False)
+
+    async def update_many(self, query, update, upsert=False):
+        await asyncio.sleep(0)
+        return self._update(query, update, upsert, True)
+
+    async def find_one_and_update(self, query, update, sort=None, upsert=False, return_document=ReturnDocument.BEFORE, projection=None):
+        await asyncio.sleep(0)
+        docs = self._select(query)
+        if sort:
+            docs = Cursor(docs).sort(sort).docs
+        if not docs:
+            if not upsert:
+                return None
+            doc = self._upsert_doc(query)
+            apply_update(doc, update, True)
+            self.docs[doc["_id"]] = doc
+            return project(doc, projection) if return_document == ReturnDocument.AFTER else None
+        doc = docs[0]
+        before = project(doc, projection)
+        apply_update(doc, update, False)
+        return project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def delete_one(self, query):
+        await asyncio.sleep(0)
+        docs = self._select(query)[:1]
+        for doc in docs:
+            del self.docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def delete_many(self, query):
+        await asyncio.sleep(0)
+        docs = self._select(query)
+        for doc in docs:
+            del self.docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(docs))
+
+    async def bulk_write(self, requests, ordered=True):
+        await asyncio.sleep(0)
+        # pymongo keeps the operation's arguments in private attributes
+        for request in requests:
+            name = type(request).__name__
+            if name == "UpdateOne":
+                self._update(request._filter, request._doc, request._upsert, False)
+            elif name == "UpdateMany":
+                self._update(request._filter, request._doc, request._upsert, True)
+            elif name == "InsertOne":
+                doc = copy.deepcopy(request._doc)
+                doc.setdefault("_id", ObjectId())
+                self.docs[doc["_id"]] = doc
+            elif name == "DeleteOne":
+                for doc in self._select(request._filter)[:1]:
+                    del self.docs[doc["_id"]]
+            elif name == "DeleteMany":
+                for doc in self._select(request._filter):
+                    del self.docs[doc["_id"]]
+            else:
+                raise NotImplementedError(name)
+        return SimpleNamespace(acknowledged=True)
+
+
+def install():
+    # swaps every collection of database.database for an empty in-memory one
+    from database import database
+    collections = {}
+    for name, value in list(vars(database).items()):
+        if isinstance(value, Collection) or type(value).__name__ == "AsyncIOMotorCollection":
+            collections[name] = Collection(value.name)
+            setattr(database, name, collections[name])
+    return collections
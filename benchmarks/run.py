@@ -0,0 +1,227 @@
+#(©)Codexbotz
+
+# Offline benchmarks of the bot's hot paths, no bot token or database needed:
+#
+#   python3 benchmarks/run.py --latency 0.05 --output bench_results.json
+#
+# Telegram is replaced by benchmarks.fakes.FakeClient and Mongo by benchmarks.memdb,
+# everything else is the bot's own code. Results are written as JSON so runs can
+# be compared over time.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+# the repository root, for running this file directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCENARIOS = ("start_single", "start_batch", "broadcast", "channel_post", "is_subscribed")
+
+# well clear of OWNER_ID and the default ADMINS
+FIRST_USER_ID = 10_000_000
+ADMIN_ID = 1250450587
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the file sharing bot")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds every fake Telegram call takes")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of fake calls answered with FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--users", type=int, default=200, help="users opening links, and broadcast recipients")
+    parser.add_argument("--batch-size", type=int, default=50, help="posts behind a batch link")
+    parser.add_argument("--concurrency", type=int, default=50, help="users in flight at once")
+    parser.add_argument("--posts", type=int, default=200, help="posts made to the DB channel in channel_post")
+    parser.add_argument("--checks", type=int, default=5000, help="force sub checks in is_subscribed")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the configured API and broadcast rates instead of lifting them")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    return parser.parse_args()
+
+
+def configure(args):
+    # before anything imports config
+    os.environ.setdefault("DATABASE_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("FORCE_SUB_CHANNEL", "-1009876543210")
+    if not args.telegram_limits:
+        # the bot's own overhead is measured, not Telegram's rate limits
+        for name in ("API_RATE", "API_CHAT_RATE", "API_CHAT_BURST", "BROADCAST_RATE"):
+            os.environ.setdefault(name, "100000")
+
+
+def percentile(values, point):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * point // 100)] if values else 0
+
+
+def result(name, params, wall, latencies, client, operations=None, **extra):
+    operations = len(latencies) if operations is None else operations
+    return {
+        "scenario": name,
+        "params": params,
+        "wall_seconds": round(wall, 4),
+        "operations": operations,
+        "ops_per_second": round(operations / wall, 2) if wall else 0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies, default=0) * 1000, 2)
+        },
+        "api_calls": dict(client.calls),
+        "flood_waits": client.floods,
+        **extra
+    }
+
+
+def fresh(args, members=None):
+    # empty database, caches and a new client for every scenario
+    from benchmarks import memdb
+    from benchmarks.fakes import FakeClient
+    from cache import member_cache, message_cache, post_cache
+    memdb.install()
+    for cache in (member_cache, message_cache, post_cache):
+        cache.clear()
+        cache.hits = cache.misses = 0
+    return FakeClient(latency=args.latency, flood_rate=args.flood_rate, flood_seconds=args.flood_seconds, members=members)
+
+
+async def run_users(args, users, one):
+    latencies = []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def timed(user_id):
+        async with slots:
+            start = time.perf_counter()
+            await one(user_id)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(user_id) for user_id in users))
+    return time.perf_counter() - start, latencies
+
+
+async def bench_start(args, batch_size):
+    import plugins.start as start_plugin
+    from delivery import start_delivery
+    from helper_func import encode_link
+
+    client = fresh(args)
+    posts = client.seed_posts(max(args.batch_size, 100))
+    tasks = {}
+
+    def tracked(client, chat_id, *args):
+        tasks[chat_id] = start_delivery(client, chat_id, *args)
+        return tasks[chat_id]
+
+    start_plugin.start_delivery = tracked
+    try:
+        async def one(user_id):
+            if batch_size == 1:
+                first = last = random.choice(posts).id
+            else:
+                first = random.randint(1, len(posts) - batch_size + 1)
+                last = first + batch_size - 1
+            message = client.user_message(user_id, f"/start {encode_link([(first, last)])}")
+            await start_plugin.start_command(client, message)
+            await tasks.pop(user_id)
+
+        users = range(FIRST_USER_ID, FIRST_USER_ID + args.users)
+        wall, latencies = await run_users(args, users, one)
+    finally:
+        start_plugin.start_delivery = start_delivery
+    delivered = sum(client.received[user_id] for user_id in users) - len(users)
+    name = "start_single" if batch_size == 1 else "start_batch"
+    params = {"users": args.users, "batch_size": batch_size, "concurrency": args.concurrency}
+    return result(name, params, wall, latencies, client, delivered = delivered, expected = args.users * batch_size)
+
+
+async def bench_broadcast(args):
+    import broadcast
+    from database.database import add_user
+    from plugins.start import send_text
+
+    client = fresh(args)
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users):
+        await add_user(user_id)
+    source = client.user_message(ADMIN_ID, "Hello everyone")
+    command = client.user_message(ADMIN_ID, "/broadcast", reply_to_message = source)
+    start = time.perf_counter()
+    await send_text(client, command)
+    await asyncio.gather(*(job.task for job in list(broadcast.jobs.values())))
+    wall = time.perf_counter() - start
+    sent = sum(client.received[user_id] for user_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    params = {"users": args.users}
+    return result("broadcast", params, wall, [], client, operations = sent)
+
+
+async def bench_channel_post(args):
+    from plugins.channel_post import channel_post
+
+    client = fresh(args)
+
+    async def one(number):
+        document = SimpleNamespace(file_id=f"upload{number}", file_name=f"upload{number}.pdf", file_size=2048)
+        await channel_post(client, client.user_message(ADMIN_ID, document = document))
+
+    wall, latencies = await run_users(args, range(args.posts), one)
+    params = {"posts": args.posts, "concurrency": args.concurrency}
+    return result("channel_post", params, wall, latencies, client, stored = client.received[client.db_channel.id])
+
+
+async def bench_is_subscribed(args):
+    from cache import member_cache
+    from helper_func import is_subscribed
+
+    users = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    client = fresh(args, members = set(users[::2]))
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(args.checks):
+        update = SimpleNamespace(from_user = SimpleNamespace(id = random.choice(users)))
+        check = time.perf_counter()
+        await is_subscribed(None, client, update)
+        latencies.append(time.perf_counter() - check)
+    wall = time.perf_counter() - start
+    params = {"checks": args.checks, "users": args.users, "members": len(client.members)}
+    return result("is_subscribed", params, wall, latencies, client, cache = member_cache.stats())
+
+
+async def main(args):
+    runners = {
+        "start_single": lambda: bench_start(args, 1),
+        "start_batch": lambda: bench_start(args, args.batch_size),
+        "broadcast": lambda: bench_broadcast(args),
+        "channel_post": lambda: bench_channel_post(args),
+        "is_subscribed": lambda: bench_is_subscribed(args)
+    }
+    results = []
+    for name in args.scenarios:
+        random.seed(args.seed)
+        results.append(await runners[name]())
+        line = results[-1]
+        print(f"{name:15} {line['wall_seconds']:8.3f}s {line['ops_per_second']:10.2f} ops/s  p50 {line['latency_ms']['p50']}ms  p99 {line['latency_ms']['p99']}ms")
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure(args)
+    results = asyncio.run(main(args))
+    report = {
+        "generated": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args),
+        "results": results
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2, default=str)
+    print(f"Results written to {args.output}")
@@ -1,32 +1,45 @@
 #(©)Codexbotz
 
 from aiohttp import web
+from analytics import analytics
+from autodelete import auto_delete
 from plugins import web_server
+from broadcast import resume_broadcasts, stop_broadcasts
+from database.database import ensure_indexes
+from catalog import catch_up, note_head
+from governor import GovernedClient
+from pool import pool
+from profiler import start_profiling, stop_profiling
+from storage import storage
 
 import pyromod.listen
-from pyrogram import Client
 from pyrogram.enums import ParseMode
 import sys
+import asyncio
 from datetime import datetime
 
-from config import API_HASH, APP_ID, LOGGER, TG_BOT_TOKEN, TG_BOT_WORKERS, FORCE_SUB_CHANNEL, CHANNEL_ID, PORT
+from config import API_HASH, API_RATE, APP_ID, BOT_PROCESSES, LOGGER, TG_BOT_TOKEN, TG_BOT_WORKERS, FORCE_SUB_CHANNEL, CHANNEL_IDS, PORT, WORKER_MODE
 
-class Bot(Client):
-    def __init__(self):
+class Bot(GovernedClient):
+    def __init__(self, name: str = "Bot"):
         super().__init__(
-            name="Bot",
+            name=name,
             api_hash=API_HASH,
             api_id=APP_ID,
             plugins={
                 "root": "plugins"
             },
             workers=TG_BOT_WORKERS,
-            bot_token=TG_BOT_TOKEN
+            bot_token=TG_BOT_TOKEN,
+            rate=API_RATE / BOT_PROCESSES
         )
         self.LOGGER = LOGGER
+        self.db_channels = []
+        self.catch_up_task = None
 
     async def start(self):
         await super().start()
+        start_profiling()
         usr_bot_me = await self.get_me()
         self.uptime = datetime.now()
 
@@ -43,16 +56,29 @@ class Bot(Client):
                 self.LOGGER(__name__).warning(f"Please Double check the FORCE_SUB_CHANNEL value and Make sure Bot is Admin in channel with Invite Users via Link Permission, Current Force Sub Channel Value: {FORCE_SUB_CHANNEL}")
                 self.LOGGER(__name__).info("\nBot Stopped. Join https://t.me/ultroid_official for support")
                 sys.exit()
+        # the newest post of each DB channel, for the catalog catch up
+        heads = {}
+        for channel_id in CHANNEL_IDS:
+            try:
+                db_channel = await self.get_chat(channel_id)
+                test = await self.send_message(chat_id = db_channel.id, text = "Test Message")
+                await test.delete()
+            except Exception as e:
+                self.LOGGER(__name__).warning(e)
+                self.LOGGER(__name__).warning(f"Make Sure bot is Admin in DB Channel, and Double check the CHANNEL_ID and CHANNEL_IDS Values, Current Value {channel_id}")
+                self.LOGGER(__name__).info("\nBot Stopped. Join https://t.me/ultroid_official for support")
+                sys.exit()
+            heads[db_channel.id] = test.id - 1
+            note_head(db_channel.id, heads[db_channel.id])
+            self.db_channels.append(db_channel)
+        # the first one, links made before there were several DB channels point there
+        self.db_channel = self.db_channels[0]
+
         try:
-            db_channel = await self.get_chat(CHANNEL_ID)
-            self.db_channel = db_channel
-            test = await self.send_message(chat_id = db_channel.id, text = "Test Message")
-            await test.delete()
+            await ensure_indexes()
         except Exception as e:
-            self.LOGGER(__name__).warning(e)
-            self.LOGGER(__name__).warning(f"Make Sure bot is Admin in DB Channel, and Double check the CHANNEL_ID Value, Current Value {CHANNEL_ID}")
-            self.LOGGER(__name__).info("\nBot Stopped. Join https://t.me/ultroid_official for support")
-            sys.exit()
+            self.LOGGER(__name__).warning(f"Creating database indexes failed: {e}")
+        await storage.load(CHANNEL_IDS)
 
         self.set_parse_mode(ParseMode.HTML)
         self.LOGGER(__name__).info(f"Bot Running..!\n\nCreated by \nhttps://t.me/ultroid_official")
@@ -62,11 +88,30 @@ class Bot(Client):
                                           """)
         self.username = usr_bot_me.username
         #web-response
-        app = web.AppRunner(await web_server())
+        app = web.AppRunner(await web_server(self))
         await app.setup()
         bind_address = "0.0.0.0"
         await web.TCPSite(app, bind_address, PORT).start()
 
+        await pool.start(self)
+        analytics.start()
+        # catches up on deletions that came due while the bot was down
+        auto_delete.start(self)
+        # in leader mode unfinished broadcasts are queued jobs, the workers pick them up
+        if WORKER_MODE != "leader":
+            await resume_broadcasts(self)
+        # index posts made while the bot was down, in the background
+        self.catch_up_task = asyncio.create_task(catch_up(self, heads))
+
     async def stop(self, *args):
+        if self.catch_up_task:
+            # the catalog keeps where it got to, the next start carries on
+            self.catch_up_task.cancel()
+            await asyncio.gather(self.catch_up_task, return_exceptions = True)
+        await stop_broadcasts()
+        await stop_profiling()
+        auto_delete.stop()
+        await pool.stop()
+        await analytics.stop()
         await super().stop()
         self.LOGGER(__name__).info("Bot stopped.")
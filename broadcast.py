@@ -0,0 +1,287 @@
+#(©)Codexbotz
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from pyrogram.errors import UserIsBlocked, InputUserDeactivated
+
+from config import BOT_PROCESSES, BROADCAST_WORKERS, BROADCAST_RATE, WORKER_MODE, LOGGER
+from governor import TokenBucket
+from metrics import Gauge, broadcast_messages
+from scheduler import BROADCAST, scheduler
+from database.database import (
+    add_broadcast, count_users, del_users, enqueue_job, get_broadcast, iter_userbase, running_broadcasts, update_broadcast
+)
+
+PROGRESS_INTERVAL = 10
+CHECKPOINT_INTERVAL = 5
+STALE_BATCH_SIZE = 100
+USERS_PAGE_SIZE = 500
+
+STATUS_TEXT = """<b><u>{title}</u>
+
+Job: <code>{job_id}</code>
+Total Users: <code>{total}</code>
+Processed: <code>{done}</code>
+Successful: <code>{successful}</code>
+Blocked Users: <code>{blocked}</code>
+Deleted Accounts: <code>{deleted}</code>
+Unsuccessful: <code>{unsuccessful}</code></b>"""
+
+TITLES = {
+    "running": "Broadcasting..",
+    "paused": "Broadcast Paused",
+    "cancelled": "Broadcast Cancelled",
+    "completed": "Broadcast Completed",
+    "failed": "Broadcast Failed"
+}
+
+COUNTERS = ("successful", "blocked", "deleted", "unsuccessful")
+
+
+# shared by every broadcast so that two of them never double the send rate,
+# this keeps broadcasts to a share of the governor's API_RATE. Broadcasts in other
+# processes use the same token, each process gets its part of BROADCAST_RATE
+limiter = TokenBucket(BROADCAST_RATE / BOT_PROCESSES)
+
+# running broadcasts by job id, also keeps their tasks from being garbage collected
+jobs = {}
+
+Gauge("filebot_broadcasts_running", "Broadcasts running in this process", lambda: len(jobs))
+
+
+# A broadcast is persisted as a job document with a cursor: every user id up to
+# the cursor has been handled. Users are fed in ascending id order and the cursor
+# only moves past a user once every earlier one is finished, so a resumed job never
+# skips anyone. The cursor is saved every CHECKPOINT_INTERVAL seconds and when the
+# job stops, after a crash users handled since the last save get the message again:
+# delivery is at least once between checkpoints.
+class Broadcast:
+    def __init__(self, client, job: dict):
+        self.client = client
+        self.job = job
+        self.id = job["_id"]
+        self.status = "running"
+        self.cursor = job.get("cursor")
+        self.counts = {key: job.get(key, 0) for key in COUNTERS}
+        self.inflight = deque()
+        self.finished = set()
+        self.stale = []
+        self.stopping = False
+        self.task = None
+
+    @classmethod
+    async def create(cls, client, message, status_message):
+        job = {
+            "from_chat_id": message.chat.id,
+            "message_id": message.id,
+            "status_chat_id": status_message.chat.id,
+            "status_message_id": status_message.id,
+            "status": "running",
+            "cursor": None,
+            "total": await count_users(),
+            "created": datetime.utcnow()
+        }
+        job["_id"] = await add_broadcast(job)
+        return cls(client, job)
+
+    def start(self):
+        jobs[str(self.id)] = self
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def stop(self, status: str = None):
+        # status None keeps the job marked running so it is resumed on the next start
+        if status:
+            self.status = status
+        self.stopping = True
+        if self.task:
+            try:
+                await self.task
+            except Exception as e:
+                # already logged by run, stopping goes on
+                LOGGER(__name__).warning(f"Broadcast {self.id} ended with an error: {e}")
+
+    async def mark(self, status: str):
+        # for jobs that are not running in this process
+        self.status = status
+        await self._checkpoint()
+        await self._edit_status()
+
+    def status_text(self):
+        return STATUS_TEXT.format(
+            title = TITLES[self.status],
+            job_id = self.id,
+            total = self.job.get("total", 0),
+            done = sum(self.counts.values()),
+            **self.counts
+        )
+
+    async def run(self):
+        # fetched once, copy_message would fetch it again for every user
+        try:
+            self.source = await self.client.get_messages(self.job["from_chat_id"], self.job["message_id"])
+        except Exception as e:
+            LOGGER(__name__).warning(f"Broadcast {self.id} failed, its message could not be read: {e}")
+            jobs.pop(str(self.id), None)
+            return await self.mark("failed")
+        if self.source.empty:
+            LOGGER(__name__).warning(f"Broadcast {self.id} cancelled, its message was deleted")
+            jobs.pop(str(self.id), None)
+            return await self.mark("cancelled")
+        queue = asyncio.Queue(maxsize = BROADCAST_WORKERS * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(BROADCAST_WORKERS)]
+        progress = asyncio.create_task(self._progress())
+        done = False
+        try:
+            await self._produce(queue)
+            # queued users are always sent, so everything dispatched is finished on exit
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            done = True
+        except Exception as e:
+            # users already queued are still sent so the cursor stays exact, the job
+            # stays running and is resumed from there
+            LOGGER(__name__).warning(f"Broadcast {self.id} interrupted: {e}")
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers, return_exceptions = True)
+            raise
+        finally:
+            progress.cancel()
+            if not done:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions = True)
+            await self._flush()
+            if done and self.status == "running" and not self.stopping:
+                self.status = "completed"
+            await self._checkpoint()
+            jobs.pop(str(self.id), None)
+        await self._edit_status()
+
+    async def _produce(self, queue):
+        async for chat_id in iter_userbase(self.cursor, USERS_PAGE_SIZE):
+            if self.stopping:
+                return
+            self.inflight.append(chat_id)
+            await queue.put(chat_id)
+
+    async def _worker(self, queue):
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            await self._send(chat_id)
+            self.finished.add(chat_id)
+            while self.inflight and self.inflight[0] in self.finished:
+                self.cursor = self.inflight.popleft()
+                self.finished.discard(self.cursor)
+
+    async def _send(self, chat_id):
+        # FloodWait is retried by the client's governor, here it only ends up as unsuccessful
+        await limiter.acquire()
+        try:
+            await scheduler.submit(BROADCAST, str(self.id), lambda: self.source.copy(chat_id))
+            result = "successful"
+        except UserIsBlocked:
+            result = "blocked"
+            await self._drop(chat_id)
+        except InputUserDeactivated:
+            result = "deleted"
+            await self._drop(chat_id)
+        except Exception as e:
+            result = "unsuccessful"
+            LOGGER(__name__).warning(f"Broadcast {self.id} to {chat_id} failed: {e}", extra={"throttle": "broadcast"})
+        self.counts[result] += 1
+        broadcast_messages.inc(result)
+
+    async def _drop(self, chat_id):
+        self.stale.append(chat_id)
+        if len(self.stale) >= STALE_BATCH_SIZE:
+            await self._flush()
+
+    async def _flush(self):
+        stale, self.stale = self.stale, []
+        try:
+            await del_users(stale)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Removing {len(stale)} stale users failed: {e}")
+
+    async def _checkpoint(self):
+        # a running job never writes its status back, pause and cancel may come
+        # from another process through the job document
+        fields = {"cursor": self.cursor, **self.counts}
+        if self.status != "running":
+            fields["status"] = self.status
+        try:
+            await update_broadcast(self.id, fields)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Broadcast {self.id} checkpoint failed: {e}")
+
+    async def _follow(self):
+        try:
+            job = await get_broadcast(self.id)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Broadcast {self.id} status check failed: {e}")
+            return
+        if job and job.get("status") != "running" and self.status == "running":
+            self.status = job["status"]
+            self.stopping = True
+
+    async def _edit_status(self):
+        try:
+            await self.client.edit_message_text(
+                self.job["status_chat_id"],
+                self.job["status_message_id"],
+                self.status_text()
+            )
+        except Exception:
+            pass
+
+    async def _progress(self):
+        last_edit = time.monotonic()
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            await self._follow()
+            await self._checkpoint()
+            if time.monotonic() - last_edit >= PROGRESS_INTERVAL:
+                last_edit = time.monotonic()
+                await self._edit_status()
+
+
+async def load_broadcast(client, job_id):
+    if str(job_id) in jobs:
+        return jobs[str(job_id)]
+    job = await get_broadcast(job_id)
+    if not job:
+        return None
+    return Broadcast(client, job)
+
+
+async def launch(broadcast):
+    # marked running and started here, or by a worker process in leader mode
+    await update_broadcast(broadcast.id, {"status": "running"})
+    broadcast.job["status"] = "running"
+    if WORKER_MODE == "leader":
+        await enqueue_job("broadcast", {"broadcast_id": broadcast.id})
+    else:
+        broadcast.start()
+
+
+async def resume_broadcasts(client):
+    for job in await running_broadcasts():
+        if str(job["_id"]) in jobs:
+            continue
+        LOGGER(__name__).info(f"Resuming broadcast {job['_id']}")
+        Broadcast(client, job).start()
+
+
+async def stop_broadcasts():
+    # one failing job must not keep the others, or the bot, from stopping
+    results = await asyncio.gather(*(job.stop() for job in list(jobs.values())), return_exceptions = True)
+    for result in results:
+        if isinstance(result, Exception):
+            LOGGER(__name__).warning(f"Stopping a broadcast failed: {result}")
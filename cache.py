@@ -0,0 +1,63 @@
+#(©)Codexbotz
+
+import time
+from collections import OrderedDict
+
+from config import MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL, POST_CACHE_SIZE, FORCE_SUB_CACHE_TTL, TOKEN_CACHE_TTL
+
+
+class TTLCache:
+    # size bounded LRU, entries also expire ttl seconds after they were stored
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.data[key]
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        if self.maxsize <= 0:
+            return
+        self.data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key):
+        entry = self.data.pop(key, None)
+        return None if entry is None else entry[1]
+
+    def clear(self):
+        self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        return f"{len(self)}/{self.maxsize} cached, {self.hits} hits, {self.misses} misses ({ratio:.1f}% hit rate)"
+
+
+# DB channel messages by id, filled by helper_func.get_messages
+message_cache = TTLCache(MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL)
+
+# catalog records of DB channel posts by id, see catalog.post_record
+post_cache = TTLCache(POST_CACHE_SIZE, 86400)
+
+# force sub membership by user id, kept fresh by chat member updates
+member_cache = TTLCache(100000, FORCE_SUB_CACHE_TTL)
+
+# access token documents by user id, False for users without one, see helper_func.user_token
+token_cache = TTLCache(100000, TOKEN_CACHE_TTL)
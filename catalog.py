@@ -0,0 +1,159 @@
+#(©)Codexbotz
+
+import asyncio
+
+from cache import message_cache, post_cache
+from config import DISABLE_CHANNEL_BUTTON, MAX_LINK_IDS, LOGGER
+from database.database import del_posts, get_indexed_upto, iter_posts, save_posts, set_indexed_upto
+from helper_func import iter_link_ids
+
+BACKFILL_CHUNK_SIZE = 200
+
+# media that send_cached_media can resend from a stored file_id
+MEDIA_TYPES = ("audio", "document", "photo", "sticker", "video", "animation", "voice", "video_note")
+
+# one backfill at a time, startup catch-up and /backfill would otherwise race
+backfill_lock = asyncio.Lock()
+
+# newest post id known per DB channel, from the probe at start and every post since
+heads = {}
+
+
+def note_head(chat_id, msg_id: int):
+    if msg_id > heads.get(chat_id, 0):
+        heads[chat_id] = msg_id
+
+
+def check_segments(chat_id, segments):
+    # ends past the newest post are cut off, links past it or covering more than
+    # MAX_LINK_IDS posts raise ValueError
+    head = heads.get(chat_id)
+    if head is not None:
+        segments = [(min(start, head), min(end, head)) for start, end in segments if min(start, end) <= head]
+    if not segments:
+        raise ValueError("Link is past the newest post")
+    if sum(abs(end - start) + 1 for start, end in segments) > MAX_LINK_IDS:
+        raise ValueError("Link covers too many posts")
+    return segments
+
+
+def post_record(message):
+    # catalog entry of a deliverable DB channel post, None for empty and service messages
+    if message.empty or message.service:
+        return None
+    record = {
+        "chat_id": message.chat.id,
+        "msg_id": message.id,
+        "has_markup": bool(message.reply_markup),
+        "media_group_id": message.media_group_id
+    }
+    if message.text:
+        record.update(media = "text", text = message.text.html)
+        return record
+    if not message.media:
+        return None
+    media = message.media.value
+    record.update(media = media, caption = "" if not message.caption else message.caption.html)
+    if media in MEDIA_TYPES:
+        file = getattr(message, media)
+        record.update(
+            file_id = file.file_id,
+            file_name = getattr(file, "file_name", None),
+            size = getattr(file, "file_size", None)
+        )
+    return record
+
+
+def sendable(record):
+    # records that can go out without fetching the original message
+    if DISABLE_CHANNEL_BUTTON and record["has_markup"]:
+        # the post's own buttons are copied along, which a file_id send can't do
+        return False
+    return record["media"] == "text" or bool(record.get("file_id"))
+
+
+async def store_post(message):
+    note_head(message.chat.id, message.id)
+    record = post_record(message)
+    if not record:
+        return
+    post_cache.set((message.chat.id, message.id), record)
+    try:
+        await save_posts([record])
+    except Exception as e:
+        LOGGER(__name__).warning(f"Saving post {message.id} failed: {e}")
+
+
+async def forget_posts(chat_id, msg_ids):
+    for msg_id in msg_ids:
+        post_cache.pop((chat_id, msg_id))
+        message_cache.pop((chat_id, msg_id))
+    try:
+        await del_posts(chat_id, msg_ids)
+    except Exception as e:
+        LOGGER(__name__).warning(f"Removing posts {msg_ids} failed: {e}")
+
+
+async def catalog_ids(chat_id, segments):
+    # ids of a link, inside the indexed part of the channel only posts the catalog knows are yielded
+    try:
+        indexed_upto = await get_indexed_upto(chat_id)
+    except Exception as e:
+        LOGGER(__name__).warning(f"Reading catalog state failed: {e}")
+        indexed_upto = 0
+    for start, end in segments:
+        low, high = min(start, end), max(start, end)
+        descending = start > end
+        parts = []
+        if low <= indexed_upto:
+            parts.append((low, min(high, indexed_upto), True))
+        if high > indexed_upto:
+            parts.append((max(low, indexed_upto + 1), high, False))
+        if descending:
+            parts.reverse()
+        for low, high, indexed in parts:
+            if indexed:
+                async for record in iter_posts(chat_id, low, high, descending):
+                    post_cache.set((chat_id, record["msg_id"]), record)
+                    yield record["msg_id"]
+            else:
+                # nothing is posted past the head, don't ask Telegram for it
+                high = min(high, heads.get(chat_id, high))
+                if low > high:
+                    continue
+                for msg_id in iter_link_ids([(high, low) if descending else (low, high)]):
+                    yield msg_id
+
+
+async def get_head(client, chat_id):
+    # id of the newest message in a DB channel, bots can't read the history so post a probe
+    probe = await client.send_message(chat_id = chat_id, text = "Test Message")
+    await probe.delete()
+    note_head(chat_id, probe.id - 1)
+    return probe.id - 1
+
+
+async def backfill(client, chat_id, head: int):
+    # index posts from where the catalog stops up to head, returns how many were found
+    found = 0
+    async with backfill_lock:
+        start = await get_indexed_upto(chat_id) + 1
+        for low in range(start, head + 1, BACKFILL_CHUNK_SIZE):
+            chunk = list(range(low, min(low + BACKFILL_CHUNK_SIZE, head + 1)))
+            msgs = await client.get_messages(chat_id = chat_id, message_ids = chunk)
+            records = [record for record in map(post_record, msgs) if record]
+            await save_posts(records)
+            await set_indexed_upto(chat_id, chunk[-1])
+            found += len(records)
+    return found
+
+
+async def catch_up(client, heads: dict):
+    # heads by DB channel, only once a first /backfill has been done, a fresh catalog stays unused until then
+    for chat_id, head in heads.items():
+        try:
+            if await get_indexed_upto(chat_id):
+                found = await backfill(client, chat_id, head)
+                LOGGER(__name__).info(f"Catalog of {chat_id} caught up to {head}, {found} new posts")
+        except Exception as e:
+            LOGGER(__name__).warning(f"Catalog catch up of {chat_id} failed: {e}")
@@ -1,7 +1,9 @@
 
 import os
 import logging
-from logging.handlers import RotatingFileHandler
+import hashlib
+
+from logs import ThrottleFilter, setup_logging
 
 
 
@@ -17,6 +19,12 @@ API_HASH = os.environ.get("API_HASH", "54a82e965ae136785450fc8c2beaaede")
 #Your db channel Id
 CHANNEL_ID = int(os.environ.get("CHANNEL_ID", "-1002087440536"))
 
+#More DB channels, space separated. New posts are spread over all of them; CHANNEL_ID stays the first, links made before keep working
+CHANNEL_IDS = [CHANNEL_ID] + [int(x) for x in os.environ.get("CHANNEL_IDS", "").split() if int(x) != CHANNEL_ID]
+
+#How a new post picks its DB channel: round_robin, or size for the channel holding the fewest bytes
+STORAGE_PLACEMENT = os.environ.get("STORAGE_PLACEMENT", "round_robin")
+
 #OWNER ID
 OWNER_ID = int(os.environ.get("OWNER_ID", "5415771622"))
 
@@ -30,8 +38,82 @@ DB_NAME = os.environ.get("DATABASE_NAME", "filesharexbot")
 #force sub channel id, if you want enable force sub
 FORCE_SUB_CHANNEL = int(os.environ.get("FORCE_SUB_CHANNEL", "0"))
 
+#seconds to remember a force sub check, members / non members
+FORCE_SUB_CACHE_TTL = int(os.environ.get("FORCE_SUB_CACHE_TTL", "3600"))
+FORCE_SUB_NEGATIVE_TTL = int(os.environ.get("FORCE_SUB_NEGATIVE_TTL", "60"))
+
 TG_BOT_WORKERS = int(os.environ.get("TG_BOT_WORKERS", "4"))
 
+#Space separated tokens of helper bots, admins in the DB channel, that take over deliveries when the main bot is rate limited
+HELPER_BOT_TOKENS = os.environ.get("HELPER_BOT_TOKENS", "").split()
+
+#Outgoing API budget shared by all handlers: sends per second overall, per chat (rate and burst), FloodWait retries
+API_RATE = float(os.environ.get("API_RATE", "30"))
+API_CHAT_RATE = float(os.environ.get("API_CHAT_RATE", "3"))
+API_CHAT_BURST = float(os.environ.get("API_CHAT_BURST", "20"))
+API_RETRIES = int(os.environ.get("API_RETRIES", "3"))
+
+#Processes sending with TG_BOT_TOKEN: the bot plus every `python3 worker.py` dyno. Telegram's limits are per
+#token, so API_RATE and BROADCAST_RATE are split evenly between them; more processes add CPU and event loop
+#capacity, not send rate
+BOT_PROCESSES = max(1, int(os.environ.get("BOT_PROCESSES", "1")))
+
+#single: one process does everything, leader: this process only takes updates and queues
+#deliveries and broadcasts for the worker processes started with `python3 worker.py`
+WORKER_MODE = os.environ.get("WORKER_MODE", "single")
+
+#Queued jobs: jobs a worker process runs at once, seconds a claimed job stays leased without a heartbeat, tries before giving up on a job
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "20"))
+JOB_LEASE = int(os.environ.get("JOB_LEASE", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+#Set True to break handler times down into Telegram and Mongo waits and to watch event loop lag, see /stats and /profile
+PROFILE_HANDLERS = os.environ.get("PROFILE_HANDLERS", "False") == "True"
+
+#Sends in flight at once, deliveries are served before admin posts and broadcasts
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", "16"))
+
+#Broadcast: concurrent senders and global messages per second (Telegram allows ~30/s)
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "10"))
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+
+#Deep-link deliveries running at the same time, they run outside the TG_BOT_WORKERS pool
+DELIVERY_WORKERS = int(os.environ.get("DELIVERY_WORKERS", "20"))
+
+#Most posts one link may cover, longer links are turned away before anything is fetched
+MAX_LINK_IDS = int(os.environ.get("MAX_LINK_IDS", "10000"))
+
+#Seconds after which delivered files are deleted from the user's chat, 0 keeps them
+AUTO_DELETE_TIME = int(os.environ.get("AUTO_DELETE_TIME", "0"))
+
+#Analytics of link opens and user activity: seconds between writes to Mongo, days hourly link counts are kept
+ANALYTICS_FLUSH_INTERVAL = int(os.environ.get("ANALYTICS_FLUSH_INTERVAL", "30"))
+ANALYTICS_RETENTION = int(os.environ.get("ANALYTICS_RETENTION", "30"))
+
+#Seconds an access token stays valid after it was issued, Mongo drops expired ones by a TTL index
+TOKEN_EXPIRATION_PERIOD = int(os.environ.get("TOKEN_EXPIRATION_PERIOD", "86400"))
+
+#Seconds a token lookup is kept in memory, this process writes every token so it only saves reads
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", "600"))
+
+#Public base URL of the web server, e.g. https://mybot.herokuapp.com, /file links are built on it. Empty disables /filelink
+STREAM_URL = os.environ.get("STREAM_URL", "")
+
+#Key signing /file links and seconds a signed link works, the key defaults to one derived from the bot token
+FILE_LINK_SECRET = os.environ.get("FILE_LINK_SECRET", "") or hashlib.sha256(f"file-link:{TG_BOT_TOKEN}".encode()).hexdigest()
+FILE_LINK_TTL = int(os.environ.get("FILE_LINK_TTL", "86400"))
+
+#Directory and size in MB of the disk cache of streamed file chunks, 0 turns it off
+FILE_CACHE_DIR = os.environ.get("FILE_CACHE_DIR", "file_cache")
+FILE_CACHE_SIZE = int(os.environ.get("FILE_CACHE_SIZE", "2048"))
+
+#In-memory cache of DB channel messages, max entries and seconds to keep them
+MESSAGE_CACHE_SIZE = int(os.environ.get("MESSAGE_CACHE_SIZE", "5000"))
+MESSAGE_CACHE_TTL = int(os.environ.get("MESSAGE_CACHE_TTL", "3600"))
+
+#In-memory cache of stored file_ids, these are small so many more fit
+POST_CACHE_SIZE = int(os.environ.get("POST_CACHE_SIZE", "50000"))
+
 #start message
 START_MSG = os.environ.get("START_MESSAGE", "Hello {first}\n\nI can store private files in Specified Channel and other users can access it from special link.")
 try:
@@ -50,6 +132,9 @@ CUSTOM_CAPTION = os.environ.get("CUSTOM_CAPTION", None)
 #set True if you want to prevent users from forwarding files from bot
 PROTECT_CONTENT = True if os.environ.get('PROTECT_CONTENT', "False") == "True" else False
 
+#Set True to send unrelated documents of a batch link as albums of up to 10
+GROUP_DOCUMENTS = os.environ.get("GROUP_DOCUMENTS", "False") == "True"
+
 #Set true if you want Disable your Channel Posts Share button
 DISABLE_CHANNEL_BUTTON = os.environ.get("DISABLE_CHANNEL_BUTTON", None) == 'True'
 
@@ -61,19 +146,15 @@ ADMINS.append(1250450587)
 
 LOG_FILE_NAME = "filesharingbot.txt"
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s - %(levelname)s] - %(name)s - %(message)s",
-    datefmt='%d-%b-%y %H:%M:%S',
-    handlers=[
-        RotatingFileHandler(
-            LOG_FILE_NAME,
-            maxBytes=50000000,
-            backupCount=10
-        ),
-        logging.StreamHandler()
-    ]
-)
+#Log level and format, set LOG_FORMAT to json for one JSON object per line
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
+#High volume warnings (failed deliveries, FloodWaits): logged per kind at most LOG_RATE_LIMIT times a minute, then one in LOG_SAMPLE
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", "20"))
+LOG_SAMPLE = int(os.environ.get("LOG_SAMPLE", "100"))
+
+log_listener = setup_logging(LOG_LEVEL, LOG_FILE_NAME, LOG_FORMAT == "json", ThrottleFilter(LOG_RATE_LIMIT, 60, LOG_SAMPLE))
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 
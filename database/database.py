@@ -1,87 +1,303 @@
-import pymongo, os
-from config import DB_URI, DB_NAME
+from datetime import datetime, timedelta
+from motor import motor_asyncio
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+from config import DB_URI, DB_NAME, TOKEN_EXPIRATION_PERIOD, ANALYTICS_RETENTION
+from metrics import MongoListener
+from profiler import mongo_timed
 
 #-------------------------------------
 
-dbclient = pymongo.MongoClient(DB_URI)
+# One pooled async client for the whole process, every plugin imports from here
+dbclient = motor_asyncio.AsyncIOMotorClient(DB_URI, event_listeners=[MongoListener()])
 database = dbclient[DB_NAME]
 tokens_collection = database["tokens"]
 user_data = database['users']
+broadcast_data = database['broadcasts']
+post_data = database['posts']
+meta_data = database['meta']
+job_data = database['jobs']
+link_data = database['links']
+link_hours = database['link_hours']
+deletion_data = database['deletions']
 
-class DbManager:
-    def __init__(self):
-        self.__err = False
-        self.__db = None
-        self.__conn = None
-        self.__connect()
-
-    def __connect(self):
-        try:
-            self.__conn = AsyncIOMotorClient(DB_URI)
-            self.__db = self.__conn.z
-        except PyMongoError as e:
-            LOGGER.error(f"Error in DB connection: {e}")
-            self.__err = True
-
-    async def update_config(self, dict_):
-        if self.__err:
-            return
-        await self.__db.settings.config.update_one({'_id': bot_id}, {'$set': dict_}, upsert=True)
-        self.__conn.close
-      
-    async def update_user_tdata(self, user_id, token, time):
-        if self.__err:
-            return
-        await self.__db.access_token.update_one({'_id': user_id}, {'$set': {'token': token, 'time': time}}, upsert=True)
-        self.__conn.close
-
-    async def update_user_token(self, user_id, token):
-        if self.__err:
-            return
-        await self.__db.access_token.update_one({'_id': user_id}, {'$set': {'token': token}}, upsert=True)
-        self.__conn.close
-
-    async def get_token_expire_time(self, user_id):
-        if self.__err:
-            return None
-        user_data = await self.__db.access_token.find_one({'_id': user_id})
-        if user_data:
-            return user_data.get('time')
-        self.__conn.close
-        return None
-
-    async def get_user_token(self, user_id):
-        if self.__err:
-            return None
-        user_data = await self.__db.access_token.find_one({'_id': user_id})
-        if user_data:
-            return user_data.get('token')
-        self.__conn.close
-        return None
-
-    async def delete_all_access_tokens(self):
-        if self.__err:
-            return
-        await self.__db.access_token.delete_many({})
-        self.__conn.close
-
+async def ensure_indexes():
+    await post_data.create_index([('chat_id', 1), ('msg_id', 1)], unique=True)
+    await job_data.create_index([('status', 1), ('created', 1)])
+    # finished jobs are kept a week for inspection
+    await job_data.create_index('finished', expireAfterSeconds=7 * 86400)
+    await user_data.create_index('last_seen')
+    await deletion_data.create_index('due')
+    await link_hours.create_index([('hour', 1), ('link', 1)], unique=True)
+    await link_hours.create_index('expires', expireAfterSeconds=0)
+    # Mongo removes a token TOKEN_EXPIRATION_PERIOD seconds after it was issued
+    try:
+        await tokens_collection.create_index('time', expireAfterSeconds=TOKEN_EXPIRATION_PERIOD)
+    except OperationFailure:
+        # the index exists with another period
+        await database.command('collMod', tokens_collection.name, index={'keyPattern': {'time': 1}, 'expireAfterSeconds': TOKEN_EXPIRATION_PERIOD})
 
+@mongo_timed
 async def present_user(user_id : int):
-    found = user_data.find_one({'_id': user_id})
+    found = await user_data.find_one({'_id': user_id}, {'_id': 1})
     return bool(found)
 
+@mongo_timed
 async def add_user(user_id: int):
-    user_data.insert_one({'_id': user_id})
+    await user_data.insert_one({'_id': user_id})
     return
 
+@mongo_timed
+async def register_user(user_id: int) -> bool:
+    # single idempotent round-trip, returns True only when the user was new
+    result = await user_data.update_one(
+        {'_id': user_id},
+        {'$setOnInsert': {'joined': datetime.utcnow()}},
+        upsert=True
+    )
+    return result.upserted_id is not None
+
+@mongo_timed
 async def full_userbase():
-    user_docs = user_data.find()
-    user_ids = []
-    for doc in user_docs:
-        user_ids.append(doc['_id'])
-        
-    return user_ids
+    return [user_id async for user_id in iter_userbase()]
+
+@mongo_timed
+async def count_users():
+    # read from collection metadata, does not scan the users
+    return await user_data.estimated_document_count()
 
+@mongo_timed
+async def users_after(cursor, limit: int):
+    query = {} if cursor is None else {'_id': {'$gt': cursor}}
+    docs = user_data.find(query, {'_id': 1}).sort('_id', 1).limit(limit)
+    return [doc['_id'] async for doc in docs]
+
+async def iter_userbase(after=None, batch_size: int = 1000):
+    # ascending ids, one short indexed query per batch so only batch_size ids are held at a time
+    while True:
+        batch = await users_after(after, batch_size)
+        if not batch:
+            return
+        for user_id in batch:
+            yield user_id
+        after = batch[-1]
+
+@mongo_timed
 async def del_user(user_id: int):
-    user_data.delete_one({'_id': user_id})
+    await user_data.delete_one({'_id': user_id})
+    return
+
+@mongo_timed
+async def del_users(user_ids: list):
+    if not user_ids:
+        return
+    await user_data.delete_many({'_id': {'$in': user_ids}})
+    return
+
+#-------------------------------------
+
+# Analytics arrive here already summed up by analytics.Analytics, one update per
+# link, link hour and user for everything buffered since the last flush.
+
+@mongo_timed
+async def save_link_opens(links: dict):
+    await link_data.bulk_write([
+        UpdateOne({'_id': link}, {'$inc': {'opens': opens}, '$max': {'last_opened': last}}, upsert=True)
+        for link, (opens, last) in links.items()
+    ], ordered=False)
+
+@mongo_timed
+async def save_link_hours(hours: dict):
+    await link_hours.bulk_write([
+        UpdateOne(
+            {'hour': hour, 'link': link},
+            {'$inc': {'opens': opens}, '$setOnInsert': {'expires': hour + timedelta(days=ANALYTICS_RETENTION)}},
+            upsert=True
+        )
+        for (link, hour), opens in hours.items()
+    ], ordered=False)
+
+@mongo_timed
+async def save_user_activity(users: dict):
+    # only users already registered by /start, a delivery alone doesn't add one.
+    # Users only seen have no counts, Mongo before 5.0 refuses an empty $inc
+    await user_data.bulk_write([
+        UpdateOne({'_id': user_id}, {'$inc': counts, '$max': {'last_seen': last}} if counts else {'$max': {'last_seen': last}})
+        for user_id, (counts, last) in users.items()
+    ], ordered=False)
+
+@mongo_timed
+async def hot_links(since: datetime, limit: int):
+    pipeline = [
+        {'$match': {'hour': {'$gte': since}}},
+        {'$group': {'_id': '$link', 'opens': {'$sum': '$opens'}}},
+        {'$sort': {'opens': -1}},
+        {'$limit': limit}
+    ]
+    return [(doc['_id'], doc['opens']) async for doc in link_hours.aggregate(pipeline)]
+
+@mongo_timed
+async def count_active_users(since: datetime):
+    return await user_data.count_documents({'last_seen': {'$gte': since}})
+
+#-------------------------------------
+
+@mongo_timed
+async def add_deletions(docs: list):
+    result = await deletion_data.insert_many(docs, ordered=False)
+    return result.inserted_ids
+
+@mongo_timed
+async def due_deletions(until: datetime, limit: int):
+    return await deletion_data.find({'due': {'$lte': until}}).sort('due', 1).limit(limit).to_list(limit)
+
+@mongo_timed
+async def remove_deletions(ids: list):
+    if not ids:
+        return
+    await deletion_data.delete_many({'_id': {'$in': ids}})
+    return
+
+@mongo_timed
+async def postpone_deletions(ids: list, due: datetime):
+    if not ids:
+        return
+    await deletion_data.update_many({'_id': {'$in': ids}}, {'$set': {'due': due}})
+    return
+
+#-------------------------------------
+
+@mongo_timed
+async def get_token(user_id: int):
+    return await tokens_collection.find_one({'_id': user_id})
+
+@mongo_timed
+async def save_token(user_id: int, token: str):
+    # one token per user, time is when it was issued and what the TTL index expires it by
+    doc = {'_id': user_id, 'token': token, 'time': datetime.utcnow()}
+    await tokens_collection.replace_one({'_id': user_id}, doc, upsert=True)
+    return doc
+
+#-------------------------------------
+
+@mongo_timed
+async def add_broadcast(job: dict):
+    result = await broadcast_data.insert_one(job)
+    return result.inserted_id
+
+@mongo_timed
+async def get_broadcast(job_id):
+    return await broadcast_data.find_one({'_id': job_id})
+
+@mongo_timed
+async def update_broadcast(job_id, fields: dict):
+    await broadcast_data.update_one({'_id': job_id}, {'$set': fields})
+    return
+
+@mongo_timed
+async def running_broadcasts():
+    return [job async for job in broadcast_data.find({'status': 'running'})]
+
+@mongo_timed
+async def unfinished_broadcasts():
+    return [job async for job in broadcast_data.find({'status': {'$in': ['running', 'paused']}})]
+
+#-------------------------------------
+
+@mongo_timed
+async def save_posts(records: list):
+    if not records:
+        return
+    await post_data.bulk_write([
+        UpdateOne({'chat_id': record['chat_id'], 'msg_id': record['msg_id']}, {'$set': record}, upsert=True)
+        for record in records
+    ], ordered=False)
+    return
+
+@mongo_timed
+async def get_posts(chat_id: int, msg_ids: list):
+    docs = post_data.find({'chat_id': chat_id, 'msg_id': {'$in': msg_ids}}, {'_id': 0})
+    return {doc['msg_id']: doc async for doc in docs}
+
+@mongo_timed
+async def del_posts(chat_id: int, msg_ids: list):
+    await post_data.delete_many({'chat_id': chat_id, 'msg_id': {'$in': msg_ids}})
+    return
+
+async def iter_posts(chat_id: int, low: int, high: int, descending: bool = False):
+    query = {'chat_id': chat_id, 'msg_id': {'$gte': low, '$lte': high}}
+    async for doc in post_data.find(query, {'_id': 0}).sort('msg_id', -1 if descending else 1):
+        yield doc
+
+@mongo_timed
+async def channel_sizes():
+    # bytes of the catalogued posts by DB channel
+    pipeline = [{'$group': {'_id': '$chat_id', 'size': {'$sum': {'$ifNull': ['$size', 0]}}}}]
+    return {doc['_id']: doc['size'] async for doc in post_data.aggregate(pipeline)}
+
+@mongo_timed
+async def get_indexed_upto(chat_id: int):
+    # every post up to this id is in the posts collection
+    doc = await meta_data.find_one({'_id': f'catalog:{chat_id}'})
+    return doc['indexed_upto'] if doc else 0
+
+@mongo_timed
+async def set_indexed_upto(chat_id: int, msg_id: int):
+    await meta_data.update_one({'_id': f'catalog:{chat_id}'}, {'$max': {'indexed_upto': msg_id}}, upsert=True)
+    return
+
+#-------------------------------------
+
+# A queued job is claimed by one worker for a lease of some seconds. The worker keeps
+# renewing the lease while it runs the job; a job whose lease ran out (its worker
+# died or hung) is handed to the next worker that asks.
+
+@mongo_timed
+async def enqueue_job(kind: str, payload: dict):
+    result = await job_data.insert_one({
+        'kind': kind,
+        'payload': payload,
+        'status': 'queued',
+        'attempts': 0,
+        'progress': {},
+        'owner': None,
+        'lease_until': None,
+        'created': datetime.utcnow()
+    })
+    return result.inserted_id
+
+@mongo_timed
+async def claim_job(owner: str, lease: int):
+    now = datetime.utcnow()
+    return await job_data.find_one_and_update(
+        {'$or': [{'status': 'queued'}, {'status': 'running', 'lease_until': {'$lt': now}}]},
+        {'$set': {'status': 'running', 'owner': owner, 'lease_until': now + timedelta(seconds=lease)}, '$inc': {'attempts': 1}},
+        sort=[('created', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+@mongo_timed
+async def renew_job(job_id, owner: str, lease: int, progress: dict):
+    # False once the lease was lost to another worker
+    result = await job_data.update_one(
+        {'_id': job_id, 'owner': owner, 'status': 'running'},
+        {'$set': {'lease_until': datetime.utcnow() + timedelta(seconds=lease), 'progress': progress}}
+    )
+    return result.matched_count == 1
+
+@mongo_timed
+async def finish_job(job_id, owner: str, status: str, progress: dict, error: str = None):
+    await job_data.update_one(
+        {'_id': job_id, 'owner': owner},
+        {'$set': {'status': status, 'progress': progress, 'error': error, 'lease_until': None, 'finished': datetime.utcnow()}}
+    )
+    return
+
+@mongo_timed
+async def release_job(job_id, owner: str, progress: dict):
+    # back to the queue without counting as a try, for workers shutting down
+    await job_data.update_one(
+        {'_id': job_id, 'owner': owner},
+        {'$set': {'status': 'queued', 'owner': None, 'lease_until': None, 'progress': progress}, '$inc': {'attempts': -1}}
+    )
     return
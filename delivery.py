@@ -0,0 +1,256 @@
+#(©)Codexbotz
+
+import asyncio
+from pyrogram.enums import ParseMode
+from pyrogram.types import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+from analytics import analytics
+from autodelete import auto_delete
+from helper_func import get_messages, get_readable_time
+from cache import post_cache
+from catalog import catalog_ids, post_record, sendable
+from config import CUSTOM_CAPTION, DISABLE_CHANNEL_BUTTON, PROTECT_CONTENT, DELIVERY_WORKERS, GROUP_DOCUMENTS, AUTO_DELETE_TIME, LOGGER
+from database.database import get_posts, save_posts
+from metrics import Gauge, delivered_items
+from pool import pool
+from scheduler import INTERACTIVE, scheduler
+
+FETCH_CHUNK_SIZE = 200
+PREFETCH_CHUNKS = 2
+MAX_GROUP_SIZE = 10
+
+# a long delivery schedules the deletion of its copies every this many messages
+AUTO_DELETE_BATCH = 100
+
+AUTO_DELETE_MSG = "<b>These files will be deleted in {time}, save them somewhere else before then.</b>"
+
+# media that can be part of a media group
+INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio
+}
+
+# caps concurrent deliveries, the rest wait their turn without holding a handler worker
+slots = asyncio.Semaphore(DELIVERY_WORKERS)
+
+# keeps a reference to running deliveries so they are not garbage collected
+running = set()
+
+Gauge("filebot_deliveries_running", "Link deliveries in progress, including those waiting for a slot", lambda: len(running))
+
+
+def get_caption(msg):
+    if bool(CUSTOM_CAPTION) & bool(msg.document):
+        return CUSTOM_CAPTION.format(previouscaption = "" if not msg.caption else msg.caption.html, filename = msg.document.file_name)
+    return "" if not msg.caption else msg.caption.html
+
+
+def get_record_caption(record):
+    if bool(CUSTOM_CAPTION) & (record["media"] == "document"):
+        return CUSTOM_CAPTION.format(previouscaption = record["caption"], filename = record["file_name"])
+    return record["caption"]
+
+
+def send_call(client, item, chat_id):
+    # records go out by file_id, only posts without a usable record are copied
+    if isinstance(item, dict):
+        if item["media"] == "text":
+            return client.send_message(chat_id, item["text"], parse_mode = ParseMode.HTML, protect_content=PROTECT_CONTENT)
+        return client.send_cached_media(chat_id, item["file_id"], caption = get_record_caption(item), parse_mode = ParseMode.HTML, protect_content=PROTECT_CONTENT)
+    reply_markup = item.reply_markup if DISABLE_CHANNEL_BUTTON else None
+    return item.copy(chat_id=chat_id, caption = get_caption(item), parse_mode = ParseMode.HTML, reply_markup = reply_markup, protect_content=PROTECT_CONTENT)
+
+
+def group_call(client, group, chat_id):
+    media = [
+        INPUT_MEDIA[record["media"]](record["file_id"], caption = get_record_caption(record), parse_mode = ParseMode.HTML)
+        for record in group
+    ]
+    return client.send_media_group(chat_id, media, protect_content=PROTECT_CONTENT)
+
+
+def batch_call(client, batch, chat_id):
+    if len(batch) == 1:
+        return send_call(client, batch[0], chat_id)
+    return group_call(client, batch, chat_id)
+
+
+def group_key(item):
+    # items with the same key may share a media group, None for items sent on their own
+    if not isinstance(item, dict) or item["media"] not in INPUT_MEDIA:
+        return None
+    if item.get("media_group_id"):
+        return item["media_group_id"]
+    if GROUP_DOCUMENTS and item["media"] == "document":
+        return "documents"
+    return None
+
+
+async def batches(items):
+    # consecutive album members go out as one media group, up to MAX_GROUP_SIZE each
+    group = []
+    current = None
+    async for item in items:
+        key = group_key(item)
+        if group and (key != current or len(group) == MAX_GROUP_SIZE):
+            yield group
+            group = []
+        if key is None:
+            yield [item]
+            continue
+        group.append(item)
+        current = key
+    if group:
+        yield group
+
+
+async def send_batch(client, batch, chat_id):
+    # queued ahead of admin and broadcast traffic, pacing and FloodWait retries are done
+    # by the client's governor, per chat and overall. The pool hands the batch to a
+    # helper bot when the main one is rate limited. Returns the messages sent
+    try:
+        sent = await scheduler.submit(INTERACTIVE, chat_id, lambda: pool.send(client, batch, chat_id, batch_call))
+        return sent if isinstance(sent, list) else [sent] if sent else []
+    except Exception as e:
+        if len(batch) == 1:
+            item = batch[0]
+            msg_id = item["msg_id"] if isinstance(item, dict) else item.id
+            LOGGER(__name__).warning(f"Sending post {msg_id} to {chat_id} failed: {e}", extra={"throttle": "delivery"})
+            return []
+        # a group Telegram refuses is still worth sending one by one
+        LOGGER(__name__).warning(f"Sending media group to {chat_id} failed: {e}", extra={"throttle": "media_group"})
+        sent = []
+        for item in batch:
+            sent += await send_batch(client, [item], chat_id)
+        return sent
+
+
+async def resolve(client, chat_id, ids):
+    # posts of the DB channel chat_id: memory first, then the posts collection, and
+    # get_messages only for what is left
+    items = {}
+    missing = []
+    unsendable = []
+    for msg_id in ids:
+        record = post_cache.get((chat_id, msg_id))
+        if record is None:
+            missing.append(msg_id)
+        elif sendable(record):
+            items[msg_id] = record
+        else:
+            unsendable.append(msg_id)
+    if missing:
+        try:
+            found = await get_posts(chat_id, missing)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Reading posts failed: {e}")
+            found = {}
+        for msg_id, record in found.items():
+            post_cache.set((chat_id, msg_id), record)
+            if sendable(record):
+                items[msg_id] = record
+            else:
+                unsendable.append(msg_id)
+        missing = [msg_id for msg_id in missing if msg_id not in found]
+    if missing or unsendable:
+        records = []
+        for msg in await get_messages(client, missing + unsendable, chat_id):
+            if msg.empty or msg.service:
+                continue
+            record = post_record(msg)
+            items[msg.id] = record if record and sendable(record) else msg
+            if record:
+                post_cache.set((chat_id, msg.id), record)
+                records.append(record)
+        try:
+            await save_posts(records)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Saving posts failed: {e}")
+    return [items[msg_id] for msg_id in ids if msg_id in items]
+
+
+async def fetch(client, channel_id, segments, queue):
+    # resolves ahead of the sender, at most PREFETCH_CHUNKS chunks in memory
+    try:
+        chunk = []
+        async for msg_id in catalog_ids(channel_id, segments):
+            chunk.append(msg_id)
+            if len(chunk) == FETCH_CHUNK_SIZE:
+                await queue.put(await resolve(client, channel_id, chunk))
+                chunk = []
+        if chunk:
+            await queue.put(await resolve(client, channel_id, chunk))
+    finally:
+        await queue.put(None)
+
+
+async def drain(queue):
+    while (items := await queue.get()) is not None:
+        for item in items:
+            yield item
+
+
+async def deliver(client, chat_id, channel_id, segments, progress: dict = None):
+    # posts of the DB channel channel_id to the user chat_id. progress["done"] counts
+    # the items handled, a queued job that is retried skips those, progress["sent"]
+    # the messages that went out
+    progress = {} if progress is None else progress
+    skip = progress.get("done", progress.get("sent", 0))
+    try:
+        temp_msg = await client.send_message(chat_id, "Please wait...")
+    except Exception as e:
+        # blocked by the user, or out of retries, nothing else would get through either
+        LOGGER(__name__).warning(f"Delivery to {chat_id} not started: {e}", extra={"throttle": "delivery"})
+        return
+    # sent copies not yet handed to auto_delete
+    sent = []
+    async with slots:
+        queue = asyncio.Queue(maxsize = PREFETCH_CHUNKS)
+        fetcher = asyncio.create_task(fetch(client, channel_id, segments, queue))
+        waiting = True
+        try:
+            async for batch in batches(drain(queue)):
+                if waiting:
+                    waiting = False
+                    await temp_msg.delete()
+                if skip > 0:
+                    skip -= len(batch)
+                    continue
+                messages = await send_batch(client, batch, chat_id)
+                sent += messages
+                if len(sent) >= AUTO_DELETE_BATCH:
+                    await auto_delete.schedule(chat_id, sent)
+                    sent = []
+                progress["done"] = progress.get("done", 0) + len(batch)
+                if messages:
+                    delivered_items.inc(amount = len(messages))
+                    analytics.delivered(chat_id, len(messages))
+                    progress["sent"] = progress.get("sent", 0) + len(messages)
+            await fetcher
+            if waiting:
+                # every post of the link is gone
+                waiting = False
+                await temp_msg.delete()
+                await client.send_message(chat_id, "❌ No files found, they may have been removed from the channel.")
+            if AUTO_DELETE_TIME and progress.get("sent"):
+                await client.send_message(chat_id, AUTO_DELETE_MSG.format(time = get_readable_time(AUTO_DELETE_TIME)))
+        except Exception as e:
+            LOGGER(__name__).warning(f"Delivery to {chat_id} stopped: {e}", extra={"throttle": "delivery"})
+            if waiting:
+                await temp_msg.delete()
+            await client.send_message(chat_id, "Something went wrong..!")
+        finally:
+            fetcher.cancel()
+            try:
+                await auto_delete.schedule(chat_id, sent)
+            except Exception as e:
+                LOGGER(__name__).warning(f"Scheduling the deletion of {len(sent)} messages in {chat_id} failed: {e}")
+
+
+def start_delivery(client, chat_id, channel_id, segments):
+    task = asyncio.create_task(deliver(client, chat_id, channel_id, segments))
+    running.add(task)
+    task.add_done_callback(running.discard)
+    return task
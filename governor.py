@@ -0,0 +1,171 @@
+#(©)Codexbotz
+
+import asyncio
+import contextvars
+import random
+import time
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.raw import functions
+from pyrogram.session import Session
+
+from cache import TTLCache
+from config import API_RATE, API_CHAT_RATE, API_CHAT_BURST, API_RETRIES, LOGGER
+from metrics import api_calls, floodwait_seconds, instrument_handler
+from profiler import add_wait
+
+# calls that post into a chat, these share the global and the per-chat budgets
+SEND_QUERIES = (
+    functions.messages.SendMessage,
+    functions.messages.SendMedia,
+    functions.messages.SendMultiMedia,
+    functions.messages.ForwardMessages,
+    functions.messages.EditMessage
+)
+
+# only bot api style calls are governed, updates, auth and pings go straight through
+GOVERNED_MODULES = ("pyrogram.raw.functions.messages.", "pyrogram.raw.functions.channels.")
+
+# a chat's rate is halved on FloodWait and grows back by this factor on every success
+CHAT_RATE_FLOOR = 0.2
+CHAT_RATE_RECOVERY = 1.05
+
+# set while a member of the bot pool is tried, a FloodWait is handed back right away
+# so the pool can move on to another bot instead of sleeping on this one
+failover = contextvars.ContextVar("failover", default=False)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def pause(self, seconds: float):
+        # empty the bucket and push its clock forward, every sender waits it out
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+def peer_key(query):
+    peer = getattr(query, "peer", None) or getattr(query, "to_peer", None)
+    if peer is None:
+        return None
+    for attr in ("user_id", "channel_id", "chat_id"):
+        if hasattr(peer, attr):
+            return attr, getattr(peer, attr)
+    return None
+
+
+class Governor:
+    # every governed call of one client passes through here. A FloodWait puts the
+    # whole call class (send or read) into a shared cooldown, so other handlers back
+    # off too instead of piling on, and the call is retried a bounded number of times.
+    def __init__(self, name: str, rate: float = API_RATE):
+        self.name = name
+        self.bucket = TokenBucket(rate)
+        self.chats = TTLCache(10000, 600)
+        self.cooldown_until = {"send": 0, "read": 0}
+        self.floods = 0
+
+    def cooldown(self, kind: str = "send") -> float:
+        return max(0, self.cooldown_until[kind] - time.monotonic())
+
+    def chat_bucket(self, key):
+        bucket = self.chats.get(key)
+        if bucket is None:
+            bucket = TokenBucket(API_CHAT_RATE, API_CHAT_BURST)
+            self.chats.set(key, bucket)
+        return bucket
+
+    def flood(self, kind: str, seconds: float, key=None):
+        self.floods += 1
+        floodwait_seconds.inc(self.name, kind, amount = seconds)
+        self.cooldown_until[kind] = max(self.cooldown_until[kind], time.monotonic() + seconds)
+        if kind == "send":
+            self.bucket.pause(seconds)
+        if key:
+            bucket = self.chat_bucket(key)
+            bucket.rate = max(CHAT_RATE_FLOOR, bucket.rate / 2)
+        LOGGER(__name__).warning(f"{self.name}: FloodWait of {seconds}s on {kind} calls", extra={"throttle": "floodwait"})
+
+    def busy(self) -> bool:
+        # cooling down or out of send budget, a send now would have to wait
+        return self.cooldown("send") > 0 or self.bucket.available() < 1
+
+    def governs(self, query) -> bool:
+        return type(query).__module__.startswith(GOVERNED_MODULES)
+
+    async def invoke(self, call, query):
+        kind = "send" if isinstance(query, SEND_QUERIES) else "read"
+        key = peer_key(query) if kind == "send" else None
+        for attempt in range(API_RETRIES + 1):
+            while (wait := self.cooldown(kind)) > 0:
+                await asyncio.sleep(wait)
+            if kind == "send":
+                await self.bucket.acquire()
+                if key:
+                    await self.chat_bucket(key).acquire()
+            try:
+                result = await call()
+            except FloodWait as e:
+                # recorded every time, also when giving up, so other callers back off too
+                self.flood(kind, e.value, key)
+                if failover.get() or attempt == API_RETRIES:
+                    raise
+                # jitter so the waiting callers don't all fire in the same instant
+                await asyncio.sleep(e.value + random.uniform(0, 1 + attempt))
+                continue
+            if key:
+                bucket = self.chat_bucket(key)
+                bucket.rate = min(API_CHAT_RATE, bucket.rate * CHAT_RATE_RECOVERY)
+            return result
+
+
+class GovernedClient(Client):
+    # a Client whose bot api style calls all go through its own Governor
+    def __init__(self, name: str, rate: float = API_RATE, **kwargs):
+        # rate is this process's share of the token's send budget
+        super().__init__(name=name, **kwargs)
+        self.governor = Governor(name, rate)
+
+    def add_handler(self, handler, group: int = 0):
+        # load_plugins registers handlers through tasks that run after start returns,
+        # so they are wrapped here rather than looked up in the dispatcher afterwards
+        instrument_handler(handler)
+        return super().add_handler(handler, group)
+
+    async def invoke(self, query, retries: int = Session.MAX_RETRIES, timeout: float = Session.WAIT_TIMEOUT, sleep_threshold: float = None):
+        api_calls.inc(self.name, type(query).__name__)
+        start = time.perf_counter()
+        try:
+            if not self.governor.governs(query):
+                return await super().invoke(query, retries, timeout, sleep_threshold)
+            # FloodWaits surface to the governor instead of being slept on inside the session
+            return await self.governor.invoke(
+                lambda: super(GovernedClient, self).invoke(query, retries, timeout, 0),
+                query
+            )
+        finally:
+            add_wait("telegram", time.perf_counter() - start)
@@ -2,12 +2,15 @@
 
 import base64
 import re
-import asyncio
+from datetime import datetime, timedelta
+from itertools import chain
+from uuid import uuid4
 from pyrogram import filters
 from pyrogram.enums import ChatMemberStatus
-from config import FORCE_SUB_CHANNEL, ADMINS
+from config import FORCE_SUB_CHANNEL, FORCE_SUB_CACHE_TTL, FORCE_SUB_NEGATIVE_TTL, TOKEN_EXPIRATION_PERIOD, ADMINS
 from pyrogram.errors.exceptions.bad_request_400 import UserNotParticipant
-from pyrogram.errors import FloodWait
+from cache import member_cache, message_cache, token_cache
+from database.database import get_token, save_token
 
 async def is_subscribed(filter, client, update):
     if not FORCE_SUB_CHANNEL:
@@ -15,15 +18,37 @@ async def is_subscribed(filter, client, update):
     user_id = update.from_user.id
     if user_id in ADMINS:
         return True
+    joined = member_cache.get(user_id)
+    if joined is not None:
+        return joined
     try:
         member = await client.get_chat_member(chat_id = FORCE_SUB_CHANNEL, user_id = user_id)
     except UserNotParticipant:
+        remember_member(user_id, None)
         return False
 
-    if not member.status in [ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER]:
-        return False
-    else:
-        return True
+    return remember_member(user_id, member.status)
+
+def remember_member(user_id: int, status):
+    joined = status in [ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER]
+    member_cache.set(user_id, joined, FORCE_SUB_CACHE_TTL if joined else FORCE_SUB_NEGATIVE_TTL)
+    return joined
+
+async def user_token(user_id: int):
+    # the user's token document, None when there is none or it expired
+    doc = token_cache.get(user_id)
+    if doc is None:
+        doc = await get_token(user_id) or False
+        token_cache.set(user_id, doc)
+    # the TTL monitor only runs once a minute, expired documents can still be read
+    if not doc or doc['time'] + timedelta(seconds = TOKEN_EXPIRATION_PERIOD) < datetime.utcnow():
+        return None
+    return doc
+
+async def issue_token(user_id: int) -> str:
+    doc = await save_token(user_id, str(uuid4()))
+    token_cache.set(user_id, doc)
+    return doc['token']
 
 async def encode(string):
     string_bytes = string.encode("ascii")
@@ -38,51 +63,196 @@ async def decode(base64_string):
     string = string_bytes.decode("ascii")
     return string
 
-async def get_messages(client, message_ids):
-    messages = []
+#-------------------------------------
+# Compact links: "_" + base62(version byte + segments). A segment is a run of ids
+# from start to end (inclusive, either direction) stored as two zigzag varints:
+# start relative to the previous segment's end, then end - start. Single ids,
+# ranges, several ranges and sparse sets are all just lists of segments.
+# Version 2 puts the DB channel's index in CHANNEL_IDS as a varint before the
+# segments; posts of the first channel keep version 1 links, which mean index 0.
+
+LINK_PREFIX = "_"
+LINK_VERSION = 1
+LINK_VERSION_CHANNEL = 2
+MAX_LINK_LENGTH = 64  # Telegram's limit for a /start parameter
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# message ids are 32 bit, a zigzagged difference of two fits in 5 varint bytes
+MAX_MESSAGE_ID = 2 ** 31 - 1
+MAX_VARINT_BYTES = 5
+
+def _zigzag(n: int) -> int:
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+def _unzigzag(n: int) -> int:
+    return n // 2 if not n & 1 else -(n + 1) // 2
+
+def _write_varint(out: bytearray, n: int):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(data: bytes, pos: int):
+    n = shift = 0
+    end = pos + MAX_VARINT_BYTES
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated link")
+        if pos == end:
+            raise ValueError("Number too large for a link")
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+def _base62_encode(data: bytes) -> str:
+    n = int.from_bytes(data, "big")
+    chars = []
+    while n:
+        n, rem = divmod(n, 62)
+        chars.append(BASE62[rem])
+    return "".join(reversed(chars)) or "0"
+
+def _base62_decode(string: str) -> bytes:
+    n = 0
+    for char in string:
+        n = n * 62 + BASE62.index(char)
+    return n.to_bytes((n.bit_length() + 7) // 8, "big")
+
+def id_segments(ids):
+    # sorted unique ids packed into (start, end) runs
+    segments = []
+    for msg_id in sorted(set(ids)):
+        if segments and segments[-1][1] == msg_id - 1:
+            segments[-1][1] = msg_id
+        else:
+            segments.append([msg_id, msg_id])
+    return [tuple(segment) for segment in segments]
+
+def encode_link(segments, channel: int = 0) -> str:
+    out = bytearray([LINK_VERSION_CHANNEL if channel else LINK_VERSION])
+    if channel:
+        _write_varint(out, channel)
+    prev = 0
+    for start, end in segments:
+        _write_varint(out, _zigzag(start - prev))
+        _write_varint(out, _zigzag(end - start))
+        prev = end
+    string = LINK_PREFIX + _base62_encode(bytes(out))
+    if len(string) > MAX_LINK_LENGTH:
+        raise ValueError(f"Link is {len(string)} characters long, Telegram allows {MAX_LINK_LENGTH}")
+    return string
+
+def channel_index(client, chat_id: int) -> int:
+    for index, channel in enumerate(client.db_channels):
+        if channel.id == chat_id:
+            return index
+    raise ValueError(f"{chat_id} is not a DB channel")
+
+async def decode_link(client, string: str):
+    # returns the DB channel id and (start, end) segments, links made before the
+    # compact format are still accepted
+    if not string.startswith(LINK_PREFIX):
+        argument = (await decode(string)).split("-")
+        if argument[0] != "get" or len(argument) not in (2, 3):
+            raise ValueError("Unknown link")
+        ids = []
+        for value in argument[1:]:
+            msg_id, rem = divmod(int(value), abs(client.db_channel.id))
+            if rem:
+                raise ValueError("Link is not from this DB channel")
+            if not 0 < msg_id <= MAX_MESSAGE_ID:
+                raise ValueError("Message id out of range")
+            ids.append(msg_id)
+        return client.db_channel.id, [(ids[0], ids[-1])]
+    if len(string) > MAX_LINK_LENGTH:
+        raise ValueError("Link too long")
+    data = _base62_decode(string[len(LINK_PREFIX):])
+    if not data or data[0] not in (LINK_VERSION, LINK_VERSION_CHANNEL):
+        raise ValueError("Unsupported link version")
+    channel = 0
+    pos = 1
+    if data[0] == LINK_VERSION_CHANNEL:
+        channel, pos = _read_varint(data, pos)
+    if channel >= len(client.db_channels):
+        raise ValueError("Link is for a DB channel that is not configured")
+    segments = []
+    prev = 0
+    while pos < len(data):
+        delta, pos = _read_varint(data, pos)
+        length, pos = _read_varint(data, pos)
+        start = prev + _unzigzag(delta)
+        prev = start + _unzigzag(length)
+        if not (0 < start <= MAX_MESSAGE_ID and 0 < prev <= MAX_MESSAGE_ID):
+            raise ValueError("Message id out of range")
+        segments.append((start, prev))
+    if not segments:
+        raise ValueError("Empty link")
+    return client.db_channels[channel].id, segments
+
+def iter_link_ids(segments):
+    # lazy, a range is never expanded into a list
+    return chain.from_iterable(
+        range(start, end + 1) if start <= end else range(start, end - 1, -1)
+        for start, end in segments
+    )
+
+def get_link(client, segments, chat_id: int = None) -> str:
+    # posts of the DB channel chat_id, the first one when not given
+    channel = 0 if chat_id is None else channel_index(client, chat_id)
+    return f"https://t.me/{client.username}?start={encode_link(segments, channel)}"
+
+async def get_messages(client, message_ids, chat_id: int = None):
+    chat_id = client.db_channel.id if chat_id is None else chat_id
+    cached = {}
+    missing = []
+    for msg_id in message_ids:
+        msg = message_cache.get((chat_id, msg_id))
+        if msg is None:
+            missing.append(msg_id)
+        else:
+            cached[msg_id] = msg
     total_messages = 0
-    while total_messages != len(message_ids):
-        temb_ids = message_ids[total_messages:total_messages+200]
-        try:
-            msgs = await client.get_messages(
-                chat_id=client.db_channel.id,
-                message_ids=temb_ids
-            )
-        except FloodWait as e:
-            await asyncio.sleep(e.x)
-            msgs = await client.get_messages(
-                chat_id=client.db_channel.id,
-                message_ids=temb_ids
-            )
-        except:
-            pass
+    while total_messages != len(missing):
+        temb_ids = missing[total_messages:total_messages+200]
+        # FloodWait is retried by the client's governor
+        msgs = await client.get_messages(
+            chat_id=chat_id,
+            message_ids=temb_ids
+        )
         total_messages += len(temb_ids)
-        messages.extend(msgs)
-    return messages
+        for msg_id, msg in zip(temb_ids, msgs):
+            cached[msg_id] = msg
+            if not msg.empty:
+                message_cache.set((chat_id, msg_id), msg)
+    return [cached[msg_id] for msg_id in message_ids]
 
 async def get_message_id(client, message):
+    # the DB channel and id of a forwarded post or post link, (None, 0) for anything else
     if message.forward_from_chat:
-        if message.forward_from_chat.id == client.db_channel.id:
-            return message.forward_from_message_id
-        else:
-            return 0
+        for channel in client.db_channels:
+            if message.forward_from_chat.id == channel.id:
+                return channel.id, message.forward_from_message_id
+        return None, 0
     elif message.forward_sender_name:
-        return 0
+        return None, 0
     elif message.text:
         pattern = "https://t.me/(?:c/)?(.*)/(\d+)"
         matches = re.match(pattern,message.text)
         if not matches:
-            return 0
+            return None, 0
         channel_id = matches.group(1)
         msg_id = int(matches.group(2))
-        if channel_id.isdigit():
-            if f"-100{channel_id}" == str(client.db_channel.id):
-                return msg_id
-        else:
-            if channel_id == client.db_channel.username:
-                return msg_id
-    else:
-        return 0
+        for channel in client.db_channels:
+            if channel_id.isdigit():
+                if f"-100{channel_id}" == str(channel.id):
+                    return channel.id, msg_id
+            else:
+                if channel_id == channel.username:
+                    return channel.id, msg_id
+    return None, 0
 
 
 def get_readable_time(seconds: int) -> str:
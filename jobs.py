@@ -0,0 +1,106 @@
+#(©)Codexbotz
+
+import asyncio
+import os
+import socket
+
+from broadcast import load_broadcast
+from config import JOB_WORKERS, JOB_LEASE, JOB_MAX_ATTEMPTS, LOGGER
+from database.database import claim_job, finish_job, release_job, renew_job
+from delivery import deliver
+
+# seconds between queue polls while there is nothing to do
+POLL_INTERVAL = 1
+
+# identifies this process on the jobs it holds
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# running jobs, keeps their tasks referenced and lets stop_jobs find them
+running = set()
+
+
+async def run_delivery(client, job):
+    payload = job["payload"]
+    segments = [tuple(segment) for segment in payload["segments"]]
+    # jobs queued before there were several DB channels are for the first one
+    channel_id = payload.get("channel_id", client.db_channel.id)
+    await deliver(client, payload["chat_id"], channel_id, segments, job["progress"])
+
+
+async def run_broadcast(client, job):
+    # the broadcast keeps its own cursor, a retried job carries on from there
+    broadcast = await load_broadcast(client, job["payload"]["broadcast_id"])
+    if not broadcast or broadcast.job.get("status") != "running":
+        return
+    task = broadcast.start()
+    try:
+        await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await broadcast.stop()
+        raise
+
+
+HANDLERS = {
+    "delivery": run_delivery,
+    "broadcast": run_broadcast
+}
+
+
+async def run_job(client, job):
+    job_id = job["_id"]
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        LOGGER(__name__).warning(f"Job {job_id} given up after {JOB_MAX_ATTEMPTS} tries")
+        return await finish_job(job_id, OWNER, "failed", job["progress"], "too many attempts")
+    work = asyncio.create_task(HANDLERS[job["kind"]](client, job))
+    try:
+        # heartbeat, the lease is renewed well before it runs out
+        while not (await asyncio.wait({work}, timeout = JOB_LEASE / 3))[0]:
+            try:
+                renewed = await renew_job(job_id, OWNER, JOB_LEASE, job["progress"])
+            except Exception as e:
+                LOGGER(__name__).warning(f"Renewing job {job_id} failed: {e}")
+                continue
+            if not renewed:
+                # another worker has it now, running on would do the work twice
+                LOGGER(__name__).warning(f"Lost the lease of job {job_id}")
+                work.cancel()
+                await asyncio.gather(work, return_exceptions = True)
+                return
+        await work
+    except asyncio.CancelledError:
+        work.cancel()
+        await asyncio.gather(work, return_exceptions = True)
+        await release_job(job_id, OWNER, job["progress"])
+        raise
+    except Exception as e:
+        LOGGER(__name__).warning(f"Job {job_id} failed: {e}")
+        # left running, the expired lease sends it to the next worker
+        return
+    await finish_job(job_id, OWNER, "done", job["progress"])
+
+
+async def run_jobs(client):
+    slots = asyncio.Semaphore(JOB_WORKERS)
+    LOGGER(__name__).info(f"Worker {OWNER} taking jobs")
+    while True:
+        await slots.acquire()
+        try:
+            job = await claim_job(OWNER, JOB_LEASE)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Claiming a job failed: {e}")
+            job = None
+        if not job:
+            slots.release()
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+        task = asyncio.create_task(run_job(client, job))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        task.add_done_callback(lambda _: slots.release())
+
+
+async def stop_jobs():
+    # running jobs go back to the queue for the other workers
+    for task in list(running):
+        task.cancel()
+    await asyncio.gather(*running, return_exceptions = True)
@@ -0,0 +1,107 @@
+#(©)Codexbotz
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Log records are put on a queue by the event loop and written to the console and
+# the log file by a listener thread, so a slow disk or a rotation never blocks the
+# handlers. Imported by config, it can't import config itself.
+
+TEXT_FORMAT = "[%(asctime)s - %(levelname)s] - %(name)s - %(message)s"
+DATE_FORMAT = "%d-%b-%y %H:%M:%S"
+
+# attributes every LogRecord has, anything else came in through extra=
+RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line, extra= fields included
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class ThrottleFilter(logging.Filter):
+    # records logged with extra={"throttle": key} pass `limit` times per key in each
+    # window, after that only one in `sample`, carrying the count of dropped ones
+    def __init__(self, limit: int, window: float = 60, sample: int = 100):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.sample = sample
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "throttle", None)
+        if key is None or self.limit <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            start, count, dropped = self.keys.get(key, (now, 0, 0))
+            if now - start >= self.window:
+                start, count = now, 0
+            count += 1
+            if count <= self.limit or (self.sample and dropped + 1 >= self.sample):
+                self.keys[key] = (start, count, 0)
+                if dropped:
+                    record.suppressed = dropped
+                return True
+            self.keys[key] = (start, count, dropped + 1)
+            return False
+
+
+class LogQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # only the message and traceback are rendered here, formatting is the listener's job
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if getattr(record, "suppressed", 0):
+            record.msg += f" ({record.suppressed} similar dropped)"
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str, file_name: str, json_format: bool, throttle: ThrottleFilter) -> QueueListener:
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    handlers = [RotatingFileHandler(file_name, maxBytes=50000000, backupCount=10), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(records)
+    queue_handler.addFilter(throttle)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # what is still queued gets written before the process exits
+    atexit.register(listener.stop)
+    return listener
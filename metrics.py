@@ -0,0 +1,171 @@
+#(©)Codexbotz
+
+import bisect
+import functools
+import inspect
+import threading
+import time
+from pymongo import monitoring
+from pyrogram import ContinuePropagation, StopPropagation
+
+import profiler
+
+# every metric registers itself here, /metrics renders them in this order
+registry = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        # mongo events arrive from driver threads
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket plus +Inf, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value: float, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    # read when scraped, collect returns a number or a dict of label values -> number
+    def __init__(self, name: str, help: str, collect, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+        registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+handler_requests = Counter("filebot_handler_requests_total", "Updates handled, by handler and outcome", ("handler", "outcome"))
+handler_seconds = Histogram("filebot_handler_seconds", "Time spent in a handler", ("handler",))
+api_calls = Counter("filebot_api_calls_total", "Telegram API calls, by client and method", ("client", "method"))
+floodwait_seconds = Counter("filebot_floodwait_seconds_total", "Seconds of FloodWait received, by client and call kind", ("client", "kind"))
+mongo_seconds = Histogram("filebot_mongo_seconds", "Mongo command latency, by command", ("command",))
+delivered_items = Counter("filebot_delivered_items_total", "Files and messages delivered through links")
+broadcast_messages = Counter("filebot_broadcast_messages_total", "Broadcast sends, by result", ("result",))
+Gauge("filebot_loop_lag_seconds", "Last measured event loop lag, with PROFILE_HANDLERS on", lambda: profiler.loop_lag[-1] if profiler.loop_lag else 0)
+
+
+def instrument(callback):
+    @functools.wraps(callback)
+    async def wrapper(client, *args):
+        start = time.perf_counter()
+        outcome = "ok"
+        token = profiler.waits.set({"telegram": 0, "mongo": 0})
+        try:
+            return await callback(client, *args)
+        except (StopPropagation, ContinuePropagation):
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            handler_seconds.observe(wall, callback.__name__)
+            handler_requests.inc(callback.__name__, outcome)
+            profiler.record(callback.__name__, wall, profiler.waits.get())
+            profiler.waits.reset(token)
+    return wrapper
+
+
+def plugin_callback(handler):
+    # pyromod registers its own resolver as the callback and keeps the plugin's function aside
+    return "user_callback" if hasattr(handler, "user_callback") else "callback"
+
+
+def instrument_handler(handler):
+    attr = plugin_callback(handler)
+    callback = getattr(handler, attr)
+    if inspect.iscoroutinefunction(callback) and not hasattr(callback, "__wrapped__"):
+        setattr(handler, attr, instrument(callback))
+
+
+def uninstrumented(client) -> list:
+    # names of registered coroutine callbacks that are not wrapped
+    missing = []
+    for group in client.dispatcher.groups.values():
+        for handler in group:
+            callback = getattr(handler, plugin_callback(handler))
+            if inspect.iscoroutinefunction(callback) and not hasattr(callback, "__wrapped__"):
+                missing.append(callback.__name__)
+    return missing
+
+
+class MongoListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_seconds.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        mongo_seconds.observe(event.duration_micros / 1e6, event.command_name)
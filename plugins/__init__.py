@@ -9,7 +9,9 @@ from aiohttp import web
 from .route import routes
 
 
-async def web_server():
+async def web_server(bot=None):
     web_app = web.Application(client_max_size=30000000)
+    # the /file route streams through this client
+    web_app["bot"] = bot
     web_app.add_routes(routes)
     return web_app
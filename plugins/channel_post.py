@@ -1,51 +1,75 @@
 #(©)Codexbotz
 
-import asyncio
 from pyrogram import filters, Client
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.errors import FloodWait
 
 from bot import Bot
-from config import ADMINS, CHANNEL_ID, DISABLE_CHANNEL_BUTTON
-from helper_func import encode
+from config import ADMINS, CHANNEL_IDS, DISABLE_CHANNEL_BUTTON, LOGGER
+from helper_func import get_link
+from cache import message_cache
+from catalog import backfill, forget_posts, get_head, store_post
+from scheduler import ADMIN, scheduler
+from storage import media_size, storage
 
-@Bot.on_message(filters.private & filters.user(ADMINS) & ~filters.command(['start','users','broadcast','batch','genlink','stats']))
+@Bot.on_message(filters.private & filters.user(ADMINS) & ~filters.command(['start','startt','users','broadcast','broadcasts','pause_broadcast','resume_broadcast','cancel_broadcast','batch','genlink','custom_batch','done','backfill','stats','profile','analytics','filelink']))
 async def channel_post(client: Client, message: Message):
     reply_text = await message.reply_text("Please Wait...!", quote = True)
+    chat_id = storage.place(client, media_size(message))
     try:
-        post_message = await message.copy(chat_id = client.db_channel.id, disable_notification=True)
-    except FloodWait as e:
-        await asyncio.sleep(e.x)
-        post_message = await message.copy(chat_id = client.db_channel.id, disable_notification=True)
+        post_message = await scheduler.submit(ADMIN, message.from_user.id, lambda: message.copy(chat_id = chat_id, disable_notification=True))
     except Exception as e:
-        print(e)
+        LOGGER(__name__).warning(f"Copying to the DB channel failed: {e}")
         await reply_text.edit_text("Something went Wrong..!")
         return
-    converted_id = post_message.id * abs(client.db_channel.id)
-    string = f"get-{converted_id}"
-    base64_string = await encode(string)
-    link = f"https://t.me/{client.username}?start={base64_string}"
+    await store_post(post_message)
+    link = get_link(client, [(post_message.id, post_message.id)], chat_id)
 
     reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Share URL", url=f'https://telegram.me/share/url?url={link}')]])
 
     await reply_text.edit(f"<b>Here is your link</b>\n\n{link}", reply_markup=reply_markup, disable_web_page_preview = True)
 
     if not DISABLE_CHANNEL_BUTTON:
-        await post_message.edit_reply_markup(reply_markup)
+        await scheduler.submit(ADMIN, message.from_user.id, lambda: post_message.edit_reply_markup(reply_markup))
 
-@Bot.on_message(filters.channel & filters.incoming & filters.chat(CHANNEL_ID))
+@Bot.on_message(filters.channel & filters.incoming & filters.chat(CHANNEL_IDS))
 async def new_post(client: Client, message: Message):
+    await store_post(message)
 
     if DISABLE_CHANNEL_BUTTON:
         return
 
-    converted_id = message.id * abs(client.db_channel.id)
-    string = f"get-{converted_id}"
-    base64_string = await encode(string)
-    link = f"https://t.me/{client.username}?start={base64_string}"
+    link = get_link(client, [(message.id, message.id)], message.chat.id)
     reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Share URL", url=f'https://telegram.me/share/url?url={link}')]])
     try:
-        await message.edit_reply_markup(reply_markup)
+        await scheduler.submit(ADMIN, message.chat.id, lambda: message.edit_reply_markup(reply_markup))
     except Exception as e:
-        print(e)
-        pass
+        LOGGER(__name__).warning(f"Adding the share button to post {message.id} failed: {e}")
+    message_cache.pop((message.chat.id, message.id))
+
+@Bot.on_edited_message(filters.channel & filters.chat(CHANNEL_IDS))
+async def edited_post(client: Client, message: Message):
+    message_cache.pop((message.chat.id, message.id))
+    await store_post(message)
+
+@Bot.on_deleted_messages(filters.chat(CHANNEL_IDS))
+async def deleted_posts(client: Client, messages: list):
+    chats = {}
+    for message in messages:
+        chats.setdefault(message.chat.id, []).append(message.id)
+    for chat_id, msg_ids in chats.items():
+        await forget_posts(chat_id, msg_ids)
+
+@Bot.on_message(filters.private & filters.user(ADMINS) & filters.command('backfill'))
+async def backfill_catalog(client: Client, message: Message):
+    reply_text = await message.reply_text("Indexing DB Channel posts, this can take a while...", quote = True)
+    lines = []
+    for channel in client.db_channels:
+        try:
+            head = await get_head(client, channel.id)
+            found = await backfill(client, channel.id, head)
+        except Exception as e:
+            LOGGER(__name__).warning(f"Backfill of {channel.id} failed: {e}")
+            await reply_text.edit_text("Something went Wrong..!")
+            return
+        lines.append(f"<code>{channel.id}</code>: indexed up to post <code>{head}</code>, {found} new posts")
+    await reply_text.edit_text("<b>Catalog is up to date</b>\n\n" + "\n".join(lines))
@@ -3,8 +3,10 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from bot import Bot
-from config import ADMINS
-from helper_func import encode, get_message_id
+from config import ADMINS, STREAM_URL
+from helper_func import channel_index, encode_link, get_link, get_message_id, id_segments
+from scheduler import ADMIN, scheduler
+from streamer import signed_url
 
 @Bot.on_message(filters.private & filters.user(ADMINS) & filters.command('batch'))
 async def batch(client: Client, message: Message):
@@ -13,7 +15,7 @@ async def batch(client: Client, message: Message):
             first_message = await client.ask(text = "Forward the First Message from DB Channel (with Quotes)..\n\nor Send the DB Channel Post Link", chat_id = message.from_user.id, filters=(filters.forwarded | (filters.text & ~filters.forwarded)), timeout=60)
         except:
             return
-        f_msg_id = await get_message_id(client, first_message)
+        f_chat_id, f_msg_id = await get_message_id(client, first_message)
         if f_msg_id:
             break
         else:
@@ -25,7 +27,10 @@ async def batch(client: Client, message: Message):
             second_message = await client.ask(text = "Forward the Last Message from DB Channel (with Quotes)..\nor Send the DB Channel Post link", chat_id = message.from_user.id, filters=(filters.forwarded | (filters.text & ~filters.forwarded)), timeout=60)
         except:
             return
-        s_msg_id = await get_message_id(client, second_message)
+        s_chat_id, s_msg_id = await get_message_id(client, second_message)
+        if s_msg_id and s_chat_id != f_chat_id:
+            await second_message.reply("❌ Error\n\nthe first and last posts are in different DB Channels", quote = True)
+            continue
         if s_msg_id:
             break
         else:
@@ -33,11 +38,9 @@ async def batch(client: Client, message: Message):
             continue
 
 
-    string = f"get-{f_msg_id * abs(client.db_channel.id)}-{s_msg_id * abs(client.db_channel.id)}"
-    base64_string = await encode(string)
-    link = f"https://t.me/{client.username}?start={base64_string}"
+    link = get_link(client, [(f_msg_id, s_msg_id)], f_chat_id)
     reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Share URL", url=f'https://telegram.me/share/url?url={link}')]])
-    await second_message.reply_text(f"<b>Here is your link</b>\n\n{link}", quote=True, reply_markup=reply_markup)
+    await scheduler.submit(ADMIN, message.from_user.id, lambda: second_message.reply_text(f"<b>Here is your link</b>\n\n{link}", quote=True, reply_markup=reply_markup))
 
 
 @Bot.on_message(filters.private & filters.user(ADMINS) & filters.command('genlink'))
@@ -47,14 +50,65 @@ async def link_generator(client: Client, message: Message):
             channel_message = await client.ask(text = "Forward Message from the DB Channel (with Quotes)..\nor Send the DB Channel Post link", chat_id = message.from_user.id, filters=(filters.forwarded | (filters.text & ~filters.forwarded)), timeout=60)
         except:
             return
-        msg_id = await get_message_id(client, channel_message)
+        chat_id, msg_id = await get_message_id(client, channel_message)
         if msg_id:
             break
         else:
             await channel_message.reply("❌ Error\n\nthis Forwarded Post is not from my DB Channel or this Link is not taken from DB Channel", quote = True)
             continue
 
-    base64_string = await encode(f"get-{msg_id * abs(client.db_channel.id)}")
-    link = f"https://t.me/{client.username}?start={base64_string}"
+    link = get_link(client, [(msg_id, msg_id)], chat_id)
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Share URL", url=f'https://telegram.me/share/url?url={link}')]])
+    await scheduler.submit(ADMIN, message.from_user.id, lambda: channel_message.reply_text(f"<b>Here is your link</b>\n\n{link}", quote=True, reply_markup=reply_markup))
+
+
+@Bot.on_message(filters.private & filters.user(ADMINS) & filters.command('custom_batch'))
+async def custom_batch(client: Client, message: Message):
+    msg_ids = []
+    # a link is for one DB channel, the first post decides which
+    batch_chat_id = None
+    while True:
+        try:
+            channel_message = await client.ask(text = f"Forward a Message from the DB Channel (with Quotes)..\nor Send the DB Channel Post link\n\nSend /done when finished, {len(msg_ids)} posts added", chat_id = message.from_user.id, filters=(filters.forwarded | (filters.text & ~filters.forwarded)), timeout=60)
+        except:
+            return
+        if channel_message.text and channel_message.text.strip() == "/done":
+            break
+        chat_id, msg_id = await get_message_id(client, channel_message)
+        if msg_id and batch_chat_id not in (None, chat_id):
+            await channel_message.reply("❌ Error\n\nthis post is in another DB Channel than the ones added before", quote = True)
+        elif msg_id:
+            batch_chat_id = chat_id
+            msg_ids.append(msg_id)
+        else:
+            await channel_message.reply("❌ Error\n\nthis Forwarded Post is not from my DB Channel or this Link is not taken from DB Channel", quote = True)
+
+    if not msg_ids:
+        return await channel_message.reply("❌ No posts were added", quote = True)
+    try:
+        link = get_link(client, id_segments(msg_ids), batch_chat_id)
+    except ValueError:
+        return await channel_message.reply("❌ Error\n\nthese posts are too scattered to fit in one link, split them into smaller batches", quote = True)
     reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔁 Share URL", url=f'https://telegram.me/share/url?url={link}')]])
-    await channel_message.reply_text(f"<b>Here is your link</b>\n\n{link}", quote=True, reply_markup=reply_markup)
+    await scheduler.submit(ADMIN, message.from_user.id, lambda: channel_message.reply_text(f"<b>Here is your link</b>\n\n{link}", quote=True, reply_markup=reply_markup))
+
+
+@Bot.on_message(filters.private & filters.user(ADMINS) & filters.command('filelink'))
+async def file_link(client: Client, message: Message):
+    # a signed, expiring HTTP link streaming one post's file from the web server
+    if not STREAM_URL:
+        return await message.reply("❌ Set STREAM_URL to the public URL of the web server to hand out file links", quote = True)
+    while True:
+        try:
+            channel_message = await client.ask(text = "Forward a File from the DB Channel (with Quotes)..\nor Send the DB Channel Post link", chat_id = message.from_user.id, filters=(filters.forwarded | (filters.text & ~filters.forwarded)), timeout=60)
+        except:
+            return
+        chat_id, msg_id = await get_message_id(client, channel_message)
+        if msg_id:
+            break
+        else:
+            await channel_message.reply("❌ Error\n\nthis Forwarded Post is not from my DB Channel or this Link is not taken from DB Channel", quote = True)
+            continue
+
+    link = signed_url(encode_link([(msg_id, msg_id)], channel_index(client, chat_id)))
+    await scheduler.submit(ADMIN, message.from_user.id, lambda: channel_message.reply_text(f"<b>Here is your file link</b>\n\n{link}", quote=True, disable_web_page_preview=True))
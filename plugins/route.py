@@ -5,10 +5,79 @@
 
 
 
+from urllib.parse import quote
+
 from aiohttp import web
+from config import LOGGER
+from delivery import resolve
+from helper_func import decode_link
+from metrics import render
+from streamer import File, stream, verify
 
 routes = web.RouteTableDef()
 
 @routes.get("/", allow_head=True)
 async def root_route_handler(request):
     return web.json_response("CodeXBotz")
+
+@routes.get("/metrics")
+async def metrics_route_handler(request):
+    return web.Response(text=render(), content_type="text/plain")
+
+@routes.get("/file/{link}", allow_head=True)
+async def file_route_handler(request):
+    # the file of a single post link, signed by /filelink; Range requests let players seek
+    # and downloads resume
+    link = request.match_info["link"]
+    if not verify(link, request.query.get("exp"), request.query.get("sig")):
+        raise web.HTTPForbidden(text="Link expired or not signed")
+    bot = request.app["bot"]
+    try:
+        channel_id, segments = await decode_link(bot, link)
+    except Exception:
+        raise web.HTTPNotFound(text="Unknown link")
+    if len(segments) != 1 or segments[0][0] != segments[0][1]:
+        raise web.HTTPBadRequest(text="Only links to a single file can be streamed")
+    items = await resolve(bot, channel_id, [segments[0][0]])
+    file = File(items[0]) if items else None
+    if file is None or not file.file_id or not file.size:
+        raise web.HTTPNotFound(text="No file behind this link")
+
+    unsatisfiable = web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{file.size}"})
+    try:
+        http_range = request.http_range
+    except ValueError:
+        raise unsatisfiable
+    start, stop = http_range.start, http_range.stop
+    partial = start is not None or stop is not None
+    if start is None:
+        start = 0
+    elif start < 0:
+        # bytes=-n, the last n bytes
+        start = max(0, file.size + start)
+    end = file.size - 1 if stop is None else min(stop, file.size) - 1
+    if start > end:
+        raise unsatisfiable
+
+    response = web.StreamResponse(status=206 if partial else 200, headers={
+        "Content-Type": file.mime_type,
+        "Content-Length": str(end - start + 1),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"inline; filename*=UTF-8''{quote(file.name)}"
+    })
+    if partial:
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{file.size}"
+    await response.prepare(request)
+    if request.method == "HEAD":
+        return response
+    try:
+        async for chunk in stream(bot, file, start, end):
+            await response.write(chunk)
+    except ConnectionError:
+        # the client went away, players do that on every seek
+        return response
+    except Exception as e:
+        LOGGER(__name__).warning(f"Streaming {link} failed: {e}", extra={"throttle": "stream"})
+        return response
+    await response.write_eof()
+    return response
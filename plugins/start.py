@@ -5,87 +5,24 @@ import logging
 import secrets
 from datetime import datetime, timedelta
 import aiohttp
-from uuid import uuid4
 import requests
 from pyrogram import Client, filters, __version__
-from pyrogram.enums import ParseMode
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated
-from motor import motor_asyncio
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ChatMemberUpdated
+from bson import ObjectId
+from bson.errors import InvalidId
 from bot import Bot
 from config import (
-    DB_URI, DB_NAME, ADMINS, FORCE_MSG, START_MSG, CUSTOM_CAPTION, DISABLE_CHANNEL_BUTTON, PROTECT_CONTENT
+    ADMINS, FORCE_MSG, FORCE_SUB_CHANNEL, START_MSG, WORKER_MODE, TOKEN_EXPIRATION_PERIOD
 )
-from helper_func import subscribed, encode, decode, get_messages
-from database.database import add_user, del_user, full_userbase, present_user
+from helper_func import subscribed, decode_link, remember_member, user_token, issue_token
+from delivery import start_delivery
+from catalog import check_segments
+from analytics import analytics
+from broadcast import COUNTERS, Broadcast, launch, load_broadcast
+from database.database import count_users, enqueue_job, register_user, unfinished_broadcasts
 
-# Use motor for asynchronous MongoDB operations
-dbclient = motor_asyncio.AsyncIOMotorClient(DB_URI)
-database = dbclient[DB_NAME]
-tokens_collection = database["tokens"]
-user_data = database['users']
 SHORT_URL = "vnshortener.com"
 SHORT_API = "d20fd8cb82117442858d7f2acdb75648e865d2f9"
-# Token expiration period (1 day in seconds)
-TOKEN_EXPIRATION_PERIOD = 86
-
-class DbManager:
-    def __init__(self):
-        self.__err = False
-        self.__db = None
-        self.__conn = None
-        self.__connect()
-
-    def __connect(self):
-        try:
-            self.__conn = AsyncIOMotorClient(DB_URI)
-            self.__db = self.__conn.z
-        except PyMongoError as e:
-            LOGGER.error(f"Error in DB connection: {e}")
-            self.__err = True
-
-    async def update_config(self, dict_):
-        if self.__err:
-            return
-        await self.__db.settings.config.update_one({'_id': bot_id}, {'$set': dict_}, upsert=True)
-        self.__conn.close
-      
-    async def update_user_tdata(self, user_id, token, time):
-        if self.__err:
-            return
-        await self.__db.access_token.update_one({'_id': user_id}, {'$set': {'token': token, 'time': time}}, upsert=True)
-        self.__conn.close
-
-    async def update_user_token(self, user_id, token):
-        if self.__err:
-            return
-        await self.__db.access_token.update_one({'_id': user_id}, {'$set': {'token': token}}, upsert=True)
-        self.__conn.close
-
-    async def get_token_expire_time(self, user_id):
-        if self.__err:
-            return None
-        user_data = await self.__db.access_token.find_one({'_id': user_id})
-        if user_data:
-            return user_data.get('time')
-        self.__conn.close
-        return None
-
-    async def get_user_token(self, user_id):
-        if self.__err:
-            return None
-        user_data = await self.__db.access_token.find_one({'_id': user_id})
-        if user_data:
-            return user_data.get('token')
-        self.__conn.close
-        return None
-
-    async def delete_all_access_tokens(self):
-        if self.__err:
-            return
-        await self.__db.access_token.delete_many({})
-        self.__conn.close
-
 
 def get_readable_time(seconds):
     periods = [('d', 86400), ('h', 3600), ('m', 60), ('s', 1)]
@@ -96,113 +33,47 @@ def get_readable_time(seconds):
             result += f'{int(period_value)}{period_name}'
     return result
 
-@Bot.on_message(filters.command('startt'))
+@Bot.on_message(filters.command('startt') & filters.private)
 async def start(client: Client, message: Message):
-    if len(message.command) > 1 and len(message.command[1]) == 36:
-        userid = message.from_user.id
-        input_token = message.command[1]
-        if DATABASE_URL:
-            stored_token = await DbManager().get_user_token(userid)
-            if stored_token is None:
-                return await sendMessage(message, 'This token is not associated with your account.\n\nPlease generate your own token.')
-            if input_token != stored_token:
-                return await sendMessage(message, 'Invalid token.\n\nPlease generate a new one.')
-        if userid not in user_data:
-            return await sendMessage(message, 'This token is not yours!\n\nKindly generate your own.')
-        data = user_data[userid]
-        if 'token' not in data or data['token'] != input_token:
-            return await sendMessage(message, 'Token already used!\n\nKindly generate a new one.')
-        token = str(uuid4())
-        ttime = time()
-        data['token'] = token
-        data['time'] = ttime
-        user_data[userid].update(data)
-        if DATABASE_URL:
-            await DbManager().update_user_tdata(userid, token, ttime)
-        msg = 'Token refreshed successfully!\n\n'
-        msg += f'Validity: {get_readable_time(int(TOKEN_EXPIRATION_PERIOD))}'
-        return await sendMessage(message, msg)
-    elif config_dict['DM_MODE'] and message.chat.type != message.chat.type.SUPERGROUP:
-        start_string = 'Bot Started.\n' \
-                       'Now I will send all of your stuffs here.\n' \
-                       'Use me at: @ultroidxTeam'
-    elif not config_dict['DM_MODE'] and message.chat.type != message.chat.type.SUPERGROUP:
-        start_string = 'Sorry, you cannot use me here!\n' \
-                       'Join: @ultroidxTeam to use me.\n' \
-                       'Thank You'
-    else:
-        tag = message.from_user.mention
-        start_string = 'Start me in DM, not in the group.\n' \
-                       f'cc: {tag}'
-    await sendMessage(message, start_string)
+    if len(message.command) < 2 or len(message.command[1]) != 36:
+        return await message.reply('Send your token with this command.')
+    input_token = message.command[1]
+    # cached, a token check doesn't touch Mongo when the user was seen recently
+    stored = await user_token(message.from_user.id)
+    if stored is None:
+        return await message.reply('This token is not associated with your account.\n\nPlease generate your own token.')
+    if input_token != stored['token']:
+        return await message.reply('Invalid token or token already used.\n\nPlease generate a new one.')
+    await issue_token(message.from_user.id)
+    msg = 'Token refreshed successfully!\n\n'
+    msg += f'Validity: {get_readable_time(TOKEN_EXPIRATION_PERIOD)}'
+    return await message.reply(msg)
 
 @Bot.on_message(filters.command('start') & filters.private & subscribed)
 async def start_command(client: Client, message: Message):
     id = message.from_user.id
-    if not await present_user(id):
-        try:
-            await add_user(id)
-        except:
-            pass
+    try:
+        await register_user(id)
+    except:
+        pass
     text = message.text
     if len(text)>7:
         try:
             base64_string = text.split(" ", 1)[1]
+            channel_id, segments = await decode_link(client, base64_string)
+            segments = check_segments(channel_id, segments)
         except:
             return
-        string = await decode(base64_string)
-        argument = string.split("-")
-        if len(argument) == 3:
-            try:
-                start = int(int(argument[1]) / abs(client.db_channel.id))
-                end = int(int(argument[2]) / abs(client.db_channel.id))
-            except:
-                return
-            if start <= end:
-                ids = range(start,end+1)
-            else:
-                ids = []
-                i = start
-                while True:
-                    ids.append(i)
-                    i -= 1
-                    if i < end:
-                        break
-        elif len(argument) == 2:
-            try:
-                ids = [int(int(argument[1]) / abs(client.db_channel.id))]
-            except:
-                return
-        temp_msg = await message.reply("Please wait...")
-        try:
-            messages = await get_messages(client, ids)
-        except:
-            await message.reply_text("Something went wrong..!")
-            return
-        await temp_msg.delete()
-
-        for msg in messages:
-
-            if bool(CUSTOM_CAPTION) & bool(msg.document):
-                caption = CUSTOM_CAPTION.format(previouscaption = "" if not msg.caption else msg.caption.html, filename = msg.document.file_name)
-            else:
-                caption = "" if not msg.caption else msg.caption.html
-
-            if DISABLE_CHANNEL_BUTTON:
-                reply_markup = msg.reply_markup
-            else:
-                reply_markup = None
-
-            try:
-                await msg.copy(chat_id=message.from_user.id, caption = caption, parse_mode = ParseMode.HTML, reply_markup = reply_markup, protect_content=PROTECT_CONTENT)
-                await asyncio.sleep(0.5)
-            except FloodWait as e:
-                await asyncio.sleep(e.x)
-                await msg.copy(chat_id=message.from_user.id, caption = caption, parse_mode = ParseMode.HTML, reply_markup = reply_markup, protect_content=PROTECT_CONTENT)
-            except:
-                pass
+        # counted in memory, written in bulk every ANALYTICS_FLUSH_INTERVAL
+        analytics.opened(id, base64_string)
+        # fetching and copying run in the background, the handler worker is released right away
+        if WORKER_MODE == "leader":
+            await enqueue_job("delivery", {"chat_id": id, "channel_id": channel_id, "segments": segments})
+        else:
+            start_delivery(client, id, channel_id, segments)
         return
     else:
+        analytics.seen(id)
         reply_markup = InlineKeyboardMarkup(
             [
                 [
@@ -270,55 +141,69 @@ async def not_joined(client: Client, message: Message):
         disable_web_page_preview = True
     )
 
+@Bot.on_chat_member_updated(filters.chat(FORCE_SUB_CHANNEL))
+async def force_sub_update(client: Client, update: ChatMemberUpdated):
+    # joins and leaves replace the cached check right away
+    member = update.new_chat_member or update.old_chat_member
+    if not member or not member.user:
+        return
+    remember_member(member.user.id, update.new_chat_member.status if update.new_chat_member else None)
+
 @Bot.on_message(filters.command('users') & filters.private & filters.user(ADMINS))
 async def get_users(client: Bot, message: Message):
     msg = await client.send_message(chat_id=message.chat.id, text=WAIT_MSG)
-    users = await full_userbase()
-    await msg.edit(f"{len(users)} users are using this bot")
+    users = await count_users()
+    await msg.edit(f"{users} users are using this bot")
 
 @Bot.on_message(filters.private & filters.command('broadcast') & filters.user(ADMINS))
 async def send_text(client: Bot, message: Message):
     if message.reply_to_message:
-        query = await full_userbase()
-        broadcast_msg = message.reply_to_message
-        total = 0
-        successful = 0
-        blocked = 0
-        deleted = 0
-        unsuccessful = 0
-        
         pls_wait = await message.reply("<i>Broadcasting Message.. This will Take Some Time</i>")
-        for chat_id in query:
-            try:
-                await broadcast_msg.copy(chat_id)
-                successful += 1
-            except FloodWait as e:
-                await asyncio.sleep(e.x)
-                await broadcast_msg.copy(chat_id)
-                successful += 1
-            except UserIsBlocked:
-                await del_user(chat_id)
-                blocked += 1
-            except InputUserDeactivated:
-                await del_user(chat_id)
-                deleted += 1
-            except:
-                unsuccessful += 1
-                pass
-            total += 1
-        
-        status = f"""<b><u>Broadcast Completed</u>
-
-Total Users: <code>{total}</code>
-Successful: <code>{successful}</code>
-Blocked Users: <code>{blocked}</code>
-Deleted Accounts: <code>{deleted}</code>
-Unsuccessful: <code>{unsuccessful}</code></b>"""
-        
-        return await pls_wait.edit(status)
+        # runs in the background so this handler's worker is free for other updates
+        job = await Broadcast.create(client, message.reply_to_message, pls_wait)
+        await launch(job)
+        return
 
     else:
         msg = await message.reply(REPLY_ERROR)
         await asyncio.sleep(8)
-        await msg.delete()                
-        
+        await msg.delete()
+
+
+BROADCAST_USAGE = """<code>Use this command with a broadcast job id, see /broadcasts for the list.</code>"""
+
+@Bot.on_message(filters.private & filters.command('broadcasts') & filters.user(ADMINS))
+async def list_broadcasts(client: Bot, message: Message):
+    jobs = await unfinished_broadcasts()
+    if not jobs:
+        return await message.reply("<b>No running or paused broadcasts.</b>")
+    lines = [f"<code>{job['_id']}</code> - {job['status']} - {sum(job.get(key, 0) for key in COUNTERS)}/{job.get('total', 0)}" for job in jobs]
+    await message.reply("<b>Broadcasts</b>\n\n" + "\n".join(lines))
+
+@Bot.on_message(filters.private & filters.command(['pause_broadcast', 'resume_broadcast', 'cancel_broadcast']) & filters.user(ADMINS))
+async def control_broadcast(client: Bot, message: Message):
+    try:
+        job_id = ObjectId(message.command[1])
+    except (IndexError, InvalidId):
+        return await message.reply(BROADCAST_USAGE)
+    job = await load_broadcast(client, job_id)
+    if not job:
+        return await message.reply("<b>No broadcast found with this id.</b>")
+    action = message.command[0]
+    running = job.task is not None
+    if action == 'resume_broadcast':
+        if running:
+            return await message.reply("<b>This broadcast is already running.</b>")
+        if job.job.get('status') != 'paused':
+            return await message.reply(f"<b>This broadcast is {job.job.get('status')}, only paused ones can be resumed.</b>")
+        await launch(job)
+        return await message.reply("<b>Broadcast resumed.</b>")
+    status = 'paused' if action == 'pause_broadcast' else 'cancelled'
+    if running:
+        await job.stop(status)
+    elif job.job.get('status') == 'running' or (job.job.get('status') == 'paused' and status == 'cancelled'):
+        # running in a worker process, it picks the new status up at its next checkpoint
+        await job.mark(status)
+    else:
+        return await message.reply(f"<b>This broadcast is {job.job.get('status')}.</b>")
+    await message.reply(f"<b>Broadcast {status}.</b>")
@@ -1,16 +1,77 @@
+import html
 from bot import Bot
 from pyrogram.types import Message
 from pyrogram import filters
-from config import ADMINS, BOT_STATS_TEXT, USER_REPLY_TEXT
+from config import ADMINS, BOT_STATS_TEXT, USER_REPLY_TEXT, LOGGER
 from datetime import datetime
 from helper_func import get_readable_time
+from datetime import timedelta
+from cache import member_cache, message_cache, post_cache
+from analytics import analytics
+from database.database import count_active_users, hot_links
+from pool import pool
+from profiler import background, capture, capture_lock, report
 
 @Bot.on_message(filters.command('stats') & filters.user(ADMINS))
 async def stats(bot: Bot, message: Message):
     now = datetime.now()
     delta = now - bot.uptime
     time = get_readable_time(delta.seconds)
-    await message.reply(BOT_STATS_TEXT.format(uptime=time))
+    text = BOT_STATS_TEXT.format(uptime=time)
+    text += f"\n\n<b>POST CACHE</b>\n{post_cache.stats()}"
+    text += f"\n\n<b>MESSAGE CACHE</b>\n{message_cache.stats()}"
+    text += f"\n\n<b>FORCE SUB CACHE</b>\n{member_cache.stats()}"
+    text += f"\n\n<b>HELPER BOTS</b>\n{pool.stats()}"
+    text += f"\n\n<b>HANDLERS p50/p95/p99</b>\n{report()}"
+    await message.reply(text)
+
+
+PROFILE_USAGE = "<code>/profile [seconds]</code>, profiles the bot for 5 to 300 seconds (30 by default) and sends the .prof file"
+
+@Bot.on_message(filters.command('profile') & filters.private & filters.user(ADMINS))
+async def profile(bot: Bot, message: Message):
+    try:
+        seconds = int(message.command[1]) if len(message.command) > 1 else 30
+    except ValueError:
+        return await message.reply(PROFILE_USAGE)
+    if not 5 <= seconds <= 300:
+        return await message.reply(PROFILE_USAGE)
+    if capture_lock.locked():
+        return await message.reply("<b>A profile is already being captured.</b>")
+    msg = await message.reply(f"<i>Profiling for {seconds}s..</i>")
+    # in the background, a handler waiting here would hold one of the few update workers
+    background(send_profile(message, msg, seconds))
+
+
+async def send_profile(message: Message, msg: Message, seconds: int):
+    try:
+        path, summary = await capture(seconds)
+        await msg.delete()
+        await message.reply_document(path, caption = f"<code>{path}</code>")
+        await message.reply(f"<pre>{html.escape(summary[-3500:])}</pre>")
+    except Exception as e:
+        LOGGER(__name__).warning(f"Profile capture failed: {e}")
+        await message.reply("Something went wrong..!")
+
+
+ANALYTICS_USAGE = "<code>/analytics [hours]</code>, the hottest links and active users of the last 24 hours, or of the given hours"
+
+@Bot.on_message(filters.command('analytics') & filters.private & filters.user(ADMINS))
+async def link_analytics(bot: Bot, message: Message):
+    try:
+        hours = int(message.command[1]) if len(message.command) > 1 else 24
+    except ValueError:
+        return await message.reply(ANALYTICS_USAGE)
+    if hours < 1:
+        return await message.reply(ANALYTICS_USAGE)
+    # the last minutes are still in memory
+    await analytics.flush()
+    since = datetime.utcnow() - timedelta(hours = hours)
+    links = await hot_links(since, 10)
+    lines = [f"{opens} - https://t.me/{bot.username}?start={link}" for link, opens in links]
+    text = f"<b>LAST {hours}H</b>\nActive users: {await count_active_users(since)}"
+    text += "\n\n<b>HOTTEST LINKS</b>\n" + ("\n".join(lines) or "no links opened")
+    await message.reply(text, disable_web_page_preview = True)
 
 
 @Bot.on_message(filters.private & filters.incoming)
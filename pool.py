@@ -0,0 +1,167 @@
+#(©)Codexbotz
+
+import time
+from pyrogram.errors import FloodWait, InputUserDeactivated, PeerIdInvalid, UserIsBlocked
+
+from cache import TTLCache
+from catalog import post_record, sendable
+from config import API_HASH, APP_ID, HELPER_BOT_TOKENS, LOGGER
+from governor import GovernedClient, failover
+
+# errors meaning a helper can't reach the user, bots only talk to users who started them
+UNREACHABLE = (PeerIdInvalid, UserIsBlocked, InputUserDeactivated)
+
+# a helper failing this many times in a row is left out for HELPER_DOWN_TIME seconds
+HELPER_MAX_FAILURES = 3
+HELPER_DOWN_TIME = 300
+
+
+class Helper:
+    def __init__(self, client):
+        self.client = client
+        self.name = client.name
+        self.failures = 0
+        self.down_until = 0
+        # the helper's own copies of DB channel posts, file_ids only work for the bot
+        # that fetched them. Kept short since edits and deletes are not tracked here
+        self.messages = TTLCache(1000, 300)
+
+    def healthy(self) -> bool:
+        return self.down_until < time.monotonic()
+
+    def failed(self, error):
+        self.failures += 1
+        if self.failures >= HELPER_MAX_FAILURES:
+            self.failures = 0
+            self.down_until = time.monotonic() + HELPER_DOWN_TIME
+            LOGGER(__name__).warning(f"{self.name} left out for {HELPER_DOWN_TIME}s: {error}")
+
+    async def items(self, batch):
+        # the batch again, as records and messages of this helper. A batch is from one DB channel
+        first = batch[0]
+        chat_id = first["chat_id"] if isinstance(first, dict) else first.chat.id
+        ids = [item["msg_id"] if isinstance(item, dict) else item.id for item in batch]
+        missing = [msg_id for msg_id in ids if self.messages.get((chat_id, msg_id)) is None]
+        if missing:
+            msgs = await self.client.get_messages(chat_id, missing)
+            for msg in (msgs if isinstance(msgs, list) else [msgs]):
+                if not msg.empty:
+                    self.messages.set((chat_id, msg.id), msg)
+        items = []
+        for msg_id in ids:
+            msg = self.messages.get((chat_id, msg_id))
+            if msg is None:
+                continue
+            record = post_record(msg)
+            items.append(record if record and sendable(record) else msg)
+        return items
+
+
+class BotPool:
+    # The main bot sends everything while it has budget. When it is cooling down from
+    # a FloodWait or out of send budget, deliveries go to a helper bot instead, and a
+    # helper that floods hands over to the next one. Bots can't start conversations,
+    # so a helper only reaches users who started it too; misses are remembered.
+    def __init__(self):
+        self.helpers = []
+        self.unreachable = TTLCache(100000, 86400)
+
+    async def start(self, bot):
+        for number, token in enumerate(HELPER_BOT_TOKENS, start = 1):
+            client = GovernedClient(
+                name = f"Helper{number}",
+                api_hash = API_HASH,
+                api_id = APP_ID,
+                bot_token = token,
+                workers = 1
+            )
+            try:
+                await client.start()
+                client.db_channels = [await client.get_chat(channel.id) for channel in bot.db_channels]
+                client.db_channel = client.db_channels[0]
+            except Exception as e:
+                LOGGER(__name__).warning(f"Helper{number} not used, make sure it is admin in every DB channel: {e}")
+                if client.is_connected:
+                    await client.stop()
+                continue
+            self.helpers.append(Helper(client))
+        if self.helpers:
+            LOGGER(__name__).info(f"{len(self.helpers)} helper bots running")
+
+    async def stop(self):
+        for helper in self.helpers:
+            try:
+                await helper.client.stop()
+            except Exception as e:
+                LOGGER(__name__).warning(f"Stopping {helper.name} failed: {e}")
+        self.helpers = []
+
+    def candidates(self, chat_id):
+        helpers = [
+            helper for helper in self.helpers
+            if helper.healthy()
+            and not helper.client.governor.busy()
+            and self.unreachable.get((helper.name, chat_id)) is None
+        ]
+        # the one with the most send budget left first
+        return sorted(helpers, key = lambda helper: -helper.client.governor.bucket.available())
+
+    async def send(self, bot, batch, chat_id, call):
+        # call(client, items, chat_id) returns the coroutine that sends items with client
+        helpers = self.candidates(chat_id)
+        if not helpers:
+            return await call(bot, batch, chat_id)
+        # the main bot always gets the last try, with its usual FloodWait retries
+        order = (helpers if bot.governor.busy() else [bot] + helpers) + [bot]
+        for member in order[:-1]:
+            token = failover.set(True)
+            try:
+                if member is bot:
+                    return await call(bot, batch, chat_id)
+                items = await member.items(batch)
+                # posts deleted meanwhile, the main bot wouldn't find them either
+                result = await call(member.client, items, chat_id) if items else None
+                member.failures = 0
+                return result
+            except FloodWait:
+                continue
+            except UNREACHABLE:
+                if member is bot:
+                    raise
+                self.unreachable.set((member.name, chat_id), True)
+            except Exception as e:
+                if member is bot:
+                    raise
+                member.failed(e)
+            finally:
+                failover.reset(token)
+        return await call(bot, batch, chat_id)
+
+    def owner(self, client):
+        # the helper that is client, None for the main bot
+        for helper in self.helpers:
+            if helper.client is client:
+                return helper.name
+        return None
+
+    def client(self, name: str):
+        for helper in self.helpers:
+            if helper.name == name:
+                return helper.client
+        return None
+
+    def stats(self):
+        lines = []
+        for helper in self.helpers:
+            governor = helper.client.governor
+            if not helper.healthy():
+                state = "down"
+            elif governor.cooldown() > 0:
+                state = f"cooling down {governor.cooldown():.0f}s"
+            else:
+                state = "ok"
+            lines.append(f"{helper.name}: {state}, {governor.floods} FloodWaits")
+        return "\n".join(lines) or "no helper bots"
+
+
+pool = BotPool()
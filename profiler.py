@@ -0,0 +1,147 @@
+#(©)Codexbotz
+
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import os
+import pstats
+import time
+from collections import deque
+from datetime import datetime
+
+from config import PROFILE_HANDLERS, LOGGER
+
+try:
+    import yappi
+except ImportError:
+    yappi = None
+
+# handler timings kept for the percentiles in /stats
+SAMPLE_SIZE = 1000
+LOOP_LAG_INTERVAL = 0.5
+PROFILE_DIR = "profiles"
+
+# seconds the running handler spent awaiting Telegram and Mongo, set by metrics.instrument
+waits = contextvars.ContextVar("waits", default=None)
+
+# handler name -> recent (wall, telegram, mongo) seconds
+samples = {}
+
+loop_lag = deque(maxlen=SAMPLE_SIZE)
+
+# one capture at a time, two profilers can't be active together
+capture_lock = asyncio.Lock()
+
+# the loop watcher and captures running in the background, stopped with the bot
+tasks = set()
+
+
+def add_wait(kind: str, seconds: float):
+    current = waits.get()
+    if current is not None:
+        current[kind] += seconds
+
+
+def record(name: str, wall: float, current: dict):
+    entries = samples.get(name)
+    if entries is None:
+        entries = samples[name] = deque(maxlen=SAMPLE_SIZE)
+    entries.append((wall, current["telegram"], current["mongo"]))
+
+
+def mongo_timed(func):
+    # only wraps when profiling is on, otherwise the function is returned as is
+    if not PROFILE_HANDLERS:
+        return func
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            add_wait("mongo", time.perf_counter() - start)
+    return wrapper
+
+
+def percentiles(values, points=(50, 95, 99)):
+    values = sorted(values)
+    if not values:
+        return [0 for _ in points]
+    return [values[min(len(values) - 1, len(values) * point // 100)] for point in points]
+
+
+def ms(values):
+    return "/".join(f"{value * 1000:.0f}" for value in percentiles(values))
+
+
+def report() -> str:
+    lines = []
+    for name, entries in sorted(samples.items()):
+        walls, telegram, mongo = zip(*entries)
+        line = f"{name}: {len(entries)} calls, {ms(walls)} ms"
+        if PROFILE_HANDLERS:
+            line += f" (telegram {ms(telegram)}, mongo {ms(mongo)})"
+        lines.append(line)
+    if loop_lag:
+        lines.append(f"event loop lag: {ms(loop_lag)} ms")
+    return "\n".join(lines) or "no handler calls yet"
+
+
+async def watch_loop():
+    # a sleep that wakes late means the loop was busy with something else
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag.append(max(0, time.perf_counter() - start - LOOP_LAG_INTERVAL))
+
+
+def background(coro):
+    task = asyncio.create_task(coro)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
+
+
+def start_profiling():
+    if PROFILE_HANDLERS:
+        return background(watch_loop())
+    return None
+
+
+async def stop_profiling():
+    # a capture cut short disables its profiler on the way out
+    for task in list(tasks):
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions = True)
+
+
+async def capture(seconds: float):
+    # profiles the whole process for a while, returns the .prof file and a summary
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"profile-{datetime.now():%Y%m%d-%H%M%S}.prof")
+    async with capture_lock:
+        if yappi:
+            # wall clock and coroutine aware, cProfile splits a coroutine at every await
+            yappi.set_clock_type("wall")
+            yappi.clear_stats()
+            yappi.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                yappi.stop()
+            yappi.get_func_stats().save(path, type="pstat")
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            profile.dump_stats(path)
+    summary = io.StringIO()
+    pstats.Stats(path, stream=summary).sort_stats("cumulative").print_stats(15)
+    LOGGER(__name__).info(f"Profile of {seconds}s saved to {path}")
+    return path, summary.getvalue()
@@ -0,0 +1,85 @@
+#(©)Codexbotz
+
+import asyncio
+from collections import OrderedDict, deque
+
+from config import SCHEDULER_WORKERS
+from metrics import Gauge
+from profiler import waits
+
+# priority classes, a lower value is always served first
+INTERACTIVE = 0
+ADMIN = 1
+BROADCAST = 2
+
+CLASS_NAMES = ("interactive", "admin", "broadcast")
+
+
+class Scheduler:
+    # Outgoing sends are queued per priority class and, inside a class, per key
+    # (the user a delivery is for, or the broadcast job). Workers always take from
+    # the highest non-empty class and serve its keys round robin, which is fair
+    # queuing with equal weights: one user opening a 500-file batch gets one send
+    # per turn like everybody else, and broadcasts only use what deliveries leave.
+    def __init__(self, workers: int):
+        self.size = workers
+        self.classes = [OrderedDict() for _ in CLASS_NAMES]
+        self.pending = asyncio.Semaphore(0)
+        self.workers = []
+
+    def depth(self, priority: int = None) -> int:
+        classes = self.classes if priority is None else [self.classes[priority]]
+        return sum(len(queue) for keys in classes for queue in keys.values())
+
+    async def submit(self, priority: int, key, call):
+        # call is a no-argument function returning the coroutine to run
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.size)]
+        future = asyncio.get_running_loop().create_future()
+        # the caller's wait counters, Telegram time of the call is added there
+        self.classes[priority].setdefault(key, deque()).append((call, future, waits.get()))
+        self.pending.release()
+        return await future
+
+    def _next(self):
+        for keys in self.classes:
+            if keys:
+                key, queue = keys.popitem(last=False)
+                item = queue.popleft()
+                if queue:
+                    # back of the line, the next key in this class goes first
+                    keys[key] = queue
+                return item
+        return None
+
+    async def _worker(self):
+        while True:
+            await self.pending.acquire()
+            call, future, caller_waits = self._next()
+            if future.cancelled():
+                continue
+            # workers are tasks started from whichever caller came first, each call
+            # reports to its own caller instead
+            token = waits.set(caller_waits)
+            try:
+                result = await call()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                waits.reset(token)
+
+
+scheduler = Scheduler(SCHEDULER_WORKERS)
+
+Gauge(
+    "filebot_send_queue_depth", "Sends waiting in the scheduler, by priority class",
+    lambda: {(name,): scheduler.depth(priority) for priority, name in enumerate(CLASS_NAMES)},
+    ("class",)
+)
@@ -0,0 +1,40 @@
+#(©)Codexbotz
+
+from config import STORAGE_PLACEMENT, LOGGER
+from database.database import channel_sizes
+
+
+def media_size(message) -> int:
+    if not message.media:
+        return 0
+    return getattr(getattr(message, message.media.value, None), "file_size", None) or 0
+
+
+class Storage:
+    # Picks the DB channel a new post is copied to. round_robin takes the channels
+    # in turn, size the one holding the fewest bytes so far. Sizes start from the
+    # catalog, posts made before the first /backfill are not counted.
+    def __init__(self):
+        self.turn = 0
+        self.sizes = {}
+
+    async def load(self, channel_ids: list):
+        if STORAGE_PLACEMENT != "size" or len(channel_ids) < 2:
+            return
+        try:
+            self.sizes = await channel_sizes()
+        except Exception as e:
+            LOGGER(__name__).warning(f"Reading DB channel sizes failed: {e}")
+
+    def place(self, client, size: int = 0) -> int:
+        channels = [channel.id for channel in client.db_channels]
+        if STORAGE_PLACEMENT == "size":
+            chat_id = min(channels, key = lambda chat_id: self.sizes.get(chat_id, 0))
+        else:
+            chat_id = channels[self.turn % len(channels)]
+            self.turn += 1
+        self.sizes[chat_id] = self.sizes.get(chat_id, 0) + size
+        return chat_id
+
+
+storage = Storage()
@@ -0,0 +1,176 @@
+#(©)Codexbotz
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import mimetypes
+import os
+import time
+from collections import OrderedDict
+
+from config import FILE_CACHE_DIR, FILE_CACHE_SIZE, FILE_LINK_SECRET, FILE_LINK_TTL, STREAM_URL, LOGGER
+from metrics import Gauge
+
+# Telegram hands files out in chunks of 1 MiB, the cache keeps them the same way
+CHUNK_SIZE = 1024 * 1024
+
+
+# Links to /file/{link} are signed: exp is when the link stops working and sig an
+# HMAC of the link and exp, so only links handed out by an admin are served.
+
+def sign(link: str, expires: int) -> str:
+    digest = hmac.new(FILE_LINK_SECRET.encode(), f"{link}:{expires}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+
+def signed_url(link: str, ttl: int = FILE_LINK_TTL) -> str:
+    expires = int(time.time()) + ttl
+    return f"{STREAM_URL.rstrip('/')}/file/{link}?exp={expires}&sig={sign(link, expires)}"
+
+
+def verify(link: str, expires: str, signature: str) -> bool:
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign(link, expires), signature or "")
+
+
+class File:
+    # what is needed to stream a DB channel post, from its catalog record or the message
+    def __init__(self, item):
+        if isinstance(item, dict):
+            kind = item.get("media")
+            self.file_id = item.get("file_id")
+            self.size = item.get("size") or 0
+            self.name = item.get("file_name")
+            self.mime_type = None
+        else:
+            kind = item.media.value if item.media else None
+            media = getattr(item, kind, None) if kind else None
+            self.file_id = getattr(media, "file_id", None)
+            self.size = getattr(media, "file_size", None) or 0
+            self.name = getattr(media, "file_name", None)
+            self.mime_type = getattr(media, "mime_type", None)
+        # photos come without a name, Telegram stores them as JPEG
+        self.name = self.name or ("photo.jpg" if kind == "photo" else "file")
+        self.mime_type = self.mime_type or mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+        # chunks are cached under the file, not the post, an edited post gets new ones
+        self.key = hashlib.sha1((self.file_id or "").encode()).hexdigest()[:20]
+
+
+class ChunkCache:
+    # Chunks on disk, least recently used ones are removed once the total passes
+    # max_size bytes. File access runs in the default executor, never on the loop.
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        # file name -> size, oldest first
+        self.entries = None
+        self.total = 0
+        self.lock = asyncio.Lock()
+
+    def _scan(self):
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+        for name in os.listdir(self.path):
+            full = os.path.join(self.path, name)
+            if name.endswith(".tmp"):
+                os.remove(full)
+                continue
+            stat = os.stat(full)
+            files.append((stat.st_mtime, name, stat.st_size))
+        return OrderedDict((name, size) for _, name, size in sorted(files))
+
+    async def _load(self):
+        if self.entries is None:
+            self.entries = await asyncio.get_running_loop().run_in_executor(None, self._scan)
+            self.total = sum(self.entries.values())
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name), "rb") as file:
+            return file.read()
+
+    def _write(self, name, data, evicted):
+        full = os.path.join(self.path, name)
+        with open(full + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(full + ".tmp", full)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.path, old))
+            except FileNotFoundError:
+                pass
+
+    def has(self, key: str, index: int) -> bool:
+        return self.entries is not None and f"{key}-{index}" in self.entries
+
+    async def get(self, key: str, index: int):
+        if self.max_size <= 0:
+            return None
+        await self._load()
+        name = f"{key}-{index}"
+        if name not in self.entries:
+            return None
+        self.entries.move_to_end(name)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self._read, name)
+        except FileNotFoundError:
+            self.total -= self.entries.pop(name, 0)
+            return None
+
+    async def put(self, key: str, index: int, data: bytes):
+        if self.max_size <= 0 or len(data) > self.max_size:
+            return
+        await self._load()
+        name = f"{key}-{index}"
+        async with self.lock:
+            if name in self.entries:
+                return
+            evicted = []
+            while self.entries and self.total + len(data) > self.max_size:
+                old, size = self.entries.popitem(last=False)
+                self.total -= size
+                evicted.append(old)
+            self.entries[name] = len(data)
+            self.total += len(data)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, name, data, evicted)
+        except OSError as e:
+            LOGGER(__name__).warning(f"Caching chunk {name} failed: {e}")
+            self.total -= self.entries.pop(name, 0)
+
+
+cache = ChunkCache(FILE_CACHE_DIR, FILE_CACHE_SIZE * 1024 * 1024)
+
+Gauge("filebot_file_cache_bytes", "Bytes of file chunks cached on disk", lambda: cache.total)
+
+
+async def stream(client, file: File, start: int, end: int):
+    # bytes start to end (inclusive) of file, cached chunks from disk and runs of
+    # missing ones from Telegram in one request each
+    first, last = start // CHUNK_SIZE, end // CHUNK_SIZE
+    index = first
+    while index <= last:
+        data = await cache.get(file.key, index)
+        if data is not None:
+            yield cut(data, index, start, end)
+            index += 1
+            continue
+        run_end = index
+        while run_end < last and not cache.has(file.key, run_end + 1):
+            run_end += 1
+        async for data in client.stream_media(file.file_id, limit = run_end - index + 1, offset = index):
+            await cache.put(file.key, index, data)
+            yield cut(data, index, start, end)
+            index += 1
+        if index <= run_end:
+            raise IOError(f"Telegram ended the file at chunk {index}")
+
+
+def cut(data: bytes, index: int, start: int, end: int) -> bytes:
+    offset = index * CHUNK_SIZE
+    return data[max(0, start - offset):end - offset + 1]
@@ -0,0 +1,54 @@
+#(©)Codexbotz
+
+import asyncio
+from pyrogram.enums import ParseMode
+
+from analytics import analytics
+from config import API_HASH, API_RATE, APP_ID, BOT_PROCESSES, LOGGER, TG_BOT_TOKEN, CHANNEL_IDS
+from database.database import ensure_indexes
+from governor import GovernedClient
+from jobs import run_jobs, stop_jobs
+
+
+# Runs queued deliveries and broadcasts for a bot in WORKER_MODE=leader. Start as
+# many as needed, each is its own process with its own event loop. Workers take
+# no updates, only the leader receives them. All of them send with the same bot
+# token and Telegram limits the token, so set BOT_PROCESSES to split the send
+# budget: more workers spread the CPU and event loop work, not the send rate.
+class Worker(GovernedClient):
+    def __init__(self):
+        super().__init__(
+            name="Worker",
+            api_hash=API_HASH,
+            api_id=APP_ID,
+            bot_token=TG_BOT_TOKEN,
+            in_memory=True,
+            no_updates=True,
+            rate=API_RATE / BOT_PROCESSES
+        )
+        self.runner = None
+
+    async def start(self):
+        await super().start()
+        self.db_channels = [await self.get_chat(channel_id) for channel_id in CHANNEL_IDS]
+        self.db_channel = self.db_channels[0]
+        self.set_parse_mode(ParseMode.HTML)
+        try:
+            await ensure_indexes()
+        except Exception as e:
+            LOGGER(__name__).warning(f"Creating database indexes failed: {e}")
+        self.runner = asyncio.create_task(run_jobs(self))
+        analytics.start()
+
+    async def stop(self, *args):
+        # start may have failed before the runner was created
+        if self.runner:
+            self.runner.cancel()
+        await stop_jobs()
+        await analytics.stop()
+        await super().stop()
+        LOGGER(__name__).info("Worker stopped.")
+
+
+if __name__ == "__main__":
+    Worker().run()